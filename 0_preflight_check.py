@@ -0,0 +1,420 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+=========================================================================================
+ Pipeline Step 0: Preflight - Orçamento de Disco e Tempo Antes de Começar
+=========================================================================================
+DESCRIÇÃO:
+  Estima, antes de qualquer download ou pré-cache, quanto espaço em disco cada etapa
+  do pipeline vai ocupar no /workspace e quanto tempo cada uma deve levar.
+  Se o pico de uso não couber no espaço livre, o script falha imediatamente e mostra
+  o detalhamento por etapa.
+
+FONTES DA ESTIMATIVA:
+  1. 'content-length' das URLs do dataset (zip único ou manifesto).
+  2. Tamanho de cada arquivo em MODELS_TO_DOWNLOAD (2_download_wan_files.py),
+     consultado no Hugging Face; modelos já baixados não contam.
+  3. Metadados dos vídeos já extraídos (quantidade, frames, resolução), se existirem.
+  4. Configurações do dataset.toml (resolução, max_frames) e do script de treinamento.
+  5. Vazões configuradas por argumento, medidas na hora (--measure_download) ou lidas
+     de um relatório do benchmark_pipeline.py (--benchmark_json).
+
+COMO USAR:
+    python 0_preflight_check.py https://exemplo.com/dataset.zip
+    python 0_preflight_check.py --manifest urls.txt --task t2v-14B --measure_download
+=========================================================================================
+"""
+
+import re
+import sys
+import json
+import time
+import shutil
+import argparse
+import subprocess
+import importlib.util
+import urllib.error
+import urllib.parse
+import urllib.request
+from pathlib import Path
+
+# --- CONFIGURAÇÕES ---
+SCRIPT_DIR = Path(__file__).resolve().parent
+WORKSPACE_DIR = Path("/workspace")
+HF_RESOLVE_URL = "https://huggingface.co/{repo_id}/resolve/main/{filename}"
+
+# Tamanhos aproximados usados quando o Hugging Face não puder ser consultado
+KNOWN_MODEL_SIZES = {
+    "wan2.1_t2v_14B_fp16.safetensors": 28_600_000_000,
+    "wan2.1_i2v_480p_14B_fp16.safetensors": 32_800_000_000,
+    "Wan2.1_VAE.pth": 508_000_000,
+    "models_t5_umt5-xxl-enc-bf16.pth": 11_400_000_000,
+    "models_clip_open-clip-xlm-roberta-large-vit-huge-14.pth": 4_770_000_000,
+}
+
+# Parâmetros do Wan 2.1 usados na estimativa do cache
+VAE_LATENT_CHANNELS = 16
+VAE_SPATIAL_FACTOR = 8
+VAE_TEMPORAL_FACTOR = 4
+I2V_IMAGE_LATENT_CHANNELS = 20 # latents da imagem condicionante (16 + máscara)
+CLIP_EMBEDDING_BYTES = 257 * 1280 * 2
+T5_MAX_TOKENS = 512
+T5_DEFAULT_TOKENS = 128 # O cache guarda só os tokens reais da legenda
+T5_TOKENS_PER_WORD = 1.5
+T5_HIDDEN_SIZE = 4096
+CACHE_BYTES_PER_VALUE = 2 # bf16
+# Soma (entrada + saída) das camadas lineares de um bloco do DiT 14B que recebem LoRA
+DIT_BLOCKS = 40
+DIT_LORA_FEATURES_PER_BLOCK = {"t2v-14B": 8 * 2 * 5120 + 2 * (5120 + 13824), "i2v-14B": 10 * 2 * 5120 + 2 * (5120 + 13824)}
+# Pesos fp32 + 3 buffers do otimizador CAME por parâmetro no estado completo
+STATE_BYTES_PER_PARAM = 4 * 4
+
+# Espaço para a etapa de legendas (wd-llm-caption-cli, venv e modelo Florence)
+CAPTION_TOOL_BYTES = 6 * 1024**3
+FRAME_BYTES = 60 * 1024 # JPEG do primeiro frame de cada vídeo
+AVERAGE_VIDEO_BYTES = 10 * 1024**2 # Usado só quando não há vídeos para inspecionar
+SAFETY_MARGIN = 0.05 # Reserva 5% do espaço livre
+
+# Vazões padrão (podem ser sobrescritas por argumentos ou pelo benchmark)
+DEFAULT_RATES = {
+    "dataset_download_mbps": 50.0,
+    "model_download_mbps": 300.0, # hf_transfer
+    "extract_mbps": 200.0,
+    "caption_videos_per_s": 1.0,
+    "latent_videos_per_s": 0.5,
+    "t5_captions_per_s": 5.0,
+    "train_seconds_per_step": 8.0,
+}
+
+
+def load_script(filename, module_name):
+    """Importa um dos scripts numerados do pipeline para reutilizar suas configurações."""
+    sys.path.insert(0, str(SCRIPT_DIR))
+    spec = importlib.util.spec_from_file_location(module_name, SCRIPT_DIR / filename)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def format_size(num_bytes):
+    return f"{num_bytes / 1024**3:8.2f} GB"
+
+
+def format_duration(seconds):
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours:3d}h{minutes:02d}m{seconds:02d}s"
+
+
+class _NoRedirect(urllib.request.HTTPRedirectHandler):
+    def redirect_request(self, *args, **kwargs):
+        return None
+
+
+def remote_size(url, timeout=15):
+    """
+    Consulta o tamanho de uma URL com HEAD. No Hugging Face, o tamanho real vem no
+    cabeçalho 'x-linked-size' do redirecionamento para o CDN.
+
+    Returns:
+        int: Tamanho em bytes, ou None se não for possível descobrir.
+    """
+    opener = urllib.request.build_opener(_NoRedirect)
+    for _ in range(5):
+        request = urllib.request.Request(url, method="HEAD")
+        try:
+            response = opener.open(request, timeout=timeout)
+        except urllib.error.HTTPError as e:
+            response = e
+        except (urllib.error.URLError, OSError):
+            return None
+        headers = response.headers
+        if headers.get("x-linked-size"):
+            return int(headers["x-linked-size"])
+        if response.status in (301, 302, 303, 307, 308) and headers.get("location"):
+            url = urllib.parse.urljoin(url, headers["location"])
+            continue
+        if response.status == 200 and headers.get("content-length"):
+            return int(headers["content-length"])
+        return None
+    return None
+
+
+def measure_download_rate(url, sample_bytes=32 * 1024**2, timeout=30):
+    """Baixa o início do arquivo (Range) para medir a vazão real da rede, em MB/s."""
+    request = urllib.request.Request(url, headers={"Range": f"bytes=0-{sample_bytes - 1}"})
+    try:
+        start = time.perf_counter()
+        received = 0
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            while received < sample_bytes:
+                chunk = response.read(1024 * 1024)
+                if not chunk:
+                    break
+                received += len(chunk)
+        elapsed = time.perf_counter() - start
+    except (urllib.error.URLError, OSError):
+        return None
+    return received / 1024**2 / max(elapsed, 1e-9) if received else None
+
+
+def read_dataset_settings(dataset_toml, workspace):
+    """
+    Lê do dataset.toml os valores que determinam o tamanho do cache.
+    Caminhos relativos partem do workspace, de onde os passos 5 e 6 são executados.
+    """
+    content = Path(dataset_toml).read_text(encoding='utf-8')
+
+    def value(key, default):
+        match = re.search(rf'^\s*{key}\s*=\s*(.+?)\s*$', content, flags=re.MULTILINE)
+        return match.group(1) if match else default
+
+    width, height = json.loads(value("resolution", "[512, 512]"))
+    video_dir = value("video_directory", '"./videos_dataset"').strip('"')
+    return {
+        "width": width,
+        "height": height,
+        "max_frames": int(value("max_frames", "81")),
+        "video_directory": Path(workspace) / video_dir,
+    }
+
+
+def scan_videos(video_dir):
+    """
+    Inspeciona os vídeos já extraídos (quantidade, tamanho e frames).
+    Usa OpenCV se disponível, senão ffprobe; sem nenhum dos dois, conta só arquivos.
+    """
+    extensions = {'.mp4', '.avi', '.mov', '.mkv', '.webm', '.m4v', '.flv', '.wmv', '.3gp', '.m2v'}
+    videos = [p for p in Path(video_dir).iterdir() if p.suffix.lower() in extensions] if Path(video_dir).is_dir() else []
+    frames = []
+    caption_tokens = []
+    for video in videos:
+        caption = video.with_suffix(".txt")
+        if caption.exists():
+            words = len(caption.read_text(encoding='utf-8', errors='ignore').split())
+            caption_tokens.append(min(T5_MAX_TOKENS, int(words * T5_TOKENS_PER_WORD) + 1))
+    try:
+        import cv2
+    except ImportError:
+        cv2 = None
+    for video in videos:
+        count = None
+        if cv2 is not None:
+            capture = cv2.VideoCapture(str(video))
+            count = int(capture.get(cv2.CAP_PROP_FRAME_COUNT)) or None
+            capture.release()
+        elif shutil.which("ffprobe"):
+            result = subprocess.run(
+                ["ffprobe", "-v", "error", "-select_streams", "v:0", "-count_packets",
+                 "-show_entries", "stream=nb_read_packets", "-of", "csv=p=0", str(video)],
+                capture_output=True, text=True
+            )
+            count = int(result.stdout.strip()) if result.stdout.strip().isdigit() else None
+        frames.append(count)
+    return {
+        "count": len(videos),
+        "bytes": sum(v.stat().st_size for v in videos),
+        "frames": frames,
+        "caption_tokens": caption_tokens,
+    }
+
+
+def latent_bytes_per_video(frames, settings, task):
+    """Tamanho do cache de latents de um vídeo (frames truncados para 4n+1, como o VAE exige)."""
+    frames = min(frames or settings["max_frames"], settings["max_frames"])
+    frames = ((frames - 1) // VAE_TEMPORAL_FACTOR) * VAE_TEMPORAL_FACTOR + 1
+    latent_frames = (frames - 1) // VAE_TEMPORAL_FACTOR + 1
+    spatial = (settings["width"] // VAE_SPATIAL_FACTOR) * (settings["height"] // VAE_SPATIAL_FACTOR)
+    size = VAE_LATENT_CHANNELS * latent_frames * spatial * CACHE_BYTES_PER_VALUE
+    if task == "i2v-14B":
+        size += I2V_IMAGE_LATENT_CHANNELS * latent_frames * spatial * CACHE_BYTES_PER_VALUE + CLIP_EMBEDDING_BYTES
+    return size
+
+
+def load_rates(args):
+    """Combina as vazões padrão com as do benchmark e as passadas por argumento."""
+    rates = dict(DEFAULT_RATES)
+    sources = {key: "padrão" for key in rates}
+    if args.benchmark_json:
+        with open(args.benchmark_json, 'r', encoding='utf-8') as f:
+            results = json.load(f)["results"]
+        # O benchmark de frame_extraction só mede a leitura do primeiro quadro com o OpenCV,
+        # não a geração de legendas, então não serve para estimar 'caption_videos_per_s'
+        measured = {
+            "extract_mbps": ("extract_zip", "mb_per_s"),
+        }
+        for key, (bench, field) in measured.items():
+            if results.get(bench, {}).get("status") == "ok":
+                rates[key] = results[bench][field]
+                sources[key] = "benchmark"
+    for key in rates:
+        if getattr(args, key) is not None:
+            rates[key] = getattr(args, key)
+            sources[key] = "argumento"
+    return rates, sources
+
+
+def main(args):
+    print("=" * 72)
+    print("🧮 Preflight: orçamento de disco e tempo do pipeline")
+    print("=" * 72)
+
+    rates, rate_sources = load_rates(args)
+    notes = []
+
+    # --- 1. Dataset (URLs) ---
+    urls = []
+    if args.zip_url:
+        urls.append(args.zip_url)
+    if args.manifest:
+        downloader = load_script("1_download_and_extract_zip.py", "download_and_extract_zip")
+        urls += [entry["url"] for entry in downloader.parse_manifest(args.manifest)]
+
+    download_bytes = 0
+    unknown_sizes = False
+    for url in urls:
+        size = remote_size(url)
+        if size is None:
+            unknown_sizes = True
+            notes.append(f"Tamanho desconhecido para '{url}' (sem content-length).")
+        else:
+            download_bytes += size
+    if urls and args.measure_download:
+        measured = measure_download_rate(urls[0])
+        if measured:
+            rates["dataset_download_mbps"] = measured
+            rate_sources["dataset_download_mbps"] = "medido"
+
+    # --- 2. Modelos ---
+    wan_files = load_script("2_download_wan_files.py", "download_wan_files")
+    models_dir = args.workspace / "models"
+    model_bytes = 0
+    for model in wan_files.MODELS_TO_DOWNLOAD:
+        if (models_dir / model["local_filename"]).exists():
+            continue
+        size = None if args.offline else remote_size(HF_RESOLVE_URL.format(repo_id=model["repo_id"], filename=model["repo_filename"]))
+        if size is None:
+            size = KNOWN_MODEL_SIZES.get(model["local_filename"], 0)
+            notes.append(f"Tamanho de '{model['local_filename']}' estimado (Hugging Face não consultado).")
+        model_bytes += size
+
+    # --- 3. Vídeos e dataset.toml ---
+    dataset_toml = args.workspace / args.dataset_toml
+    if dataset_toml.exists():
+        settings = read_dataset_settings(dataset_toml, args.workspace)
+    else:
+        settings = {"width": 512, "height": 512, "max_frames": 81, "video_directory": args.workspace / "videos_dataset"}
+        notes.append(f"'{dataset_toml}' não existe ainda; usando 512x512 e max_frames=81.")
+
+    videos = scan_videos(settings["video_directory"])
+    if videos["count"]:
+        video_count = videos["count"]
+        frames = videos["frames"]
+        # Os vídeos já estão no disco: não ocupam espaço adicional
+        extracted_bytes = 0
+        notes.append(f"{video_count} vídeos já extraídos em '{settings['video_directory']}'.")
+    else:
+        if not args.num_videos and (unknown_sizes or not download_bytes):
+            # Sem vídeos locais e sem o tamanho do download, qualquer estimativa seria um chute
+            print("\n❌ ERRO: Não há vídeos locais nem o tamanho do dataset a baixar.")
+            print("   Informe a quantidade de vídeos com --num_videos para estimar o cache e o treinamento.")
+            sys.exit(1)
+        # Sem vídeos locais: o conteúdo extraído tem aproximadamente o tamanho do zip
+        extracted_bytes = download_bytes
+        if unknown_sizes or not download_bytes:
+            extracted_bytes = max(extracted_bytes, args.num_videos * AVERAGE_VIDEO_BYTES)
+            download_bytes = extracted_bytes
+        video_count = args.num_videos or max(1, round(extracted_bytes / AVERAGE_VIDEO_BYTES))
+        frames = [None] * video_count
+        if not args.num_videos:
+            notes.append(f"Quantidade de vídeos estimada em {video_count} (use --num_videos para informar).")
+
+    # --- 4. Treinamento ---
+    training = load_script("6_trainingI2V.py" if args.task == "i2v-14B" else "6_trainingT2V.py", "training")
+    epochs = int(training.MAX_TRAIN_EPOCHS)
+    lora_params = DIT_BLOCKS * DIT_LORA_FEATURES_PER_BLOCK[args.task] * int(args.network_dim or training.NETWORK_DIM)
+    lora_bytes = lora_params * 2
+    state_bytes = lora_params * STATE_BYTES_PER_PARAM
+    train_steps = video_count * epochs
+    # LoRAs por época + as LoRAs salvas a cada N passos que o launcher mantém
+    step_loras = min(train_steps // int(training.SAVE_STATE_EVERY_N_STEPS), training.KEEP_LAST_N_STATES)
+    saved_loras = epochs // int(training.SAVE_EVERY_N_EPOCHS) + 1 + step_loras
+
+    caption_tool_bytes = 0 if (SCRIPT_DIR / "wd-llm-caption-cli").is_dir() else CAPTION_TOOL_BYTES
+
+    # --- Estimativas por etapa: (nome, bytes que ficam, pico transitório, segundos) ---
+    latent_cache = sum(latent_bytes_per_video(f, settings, args.task) for f in frames)
+    # Sem legendas para inspecionar, usa um tamanho típico de legenda do Florence
+    caption_tokens = videos["caption_tokens"]
+    average_tokens = sum(caption_tokens) / len(caption_tokens) if caption_tokens else T5_DEFAULT_TOKENS
+    t5_cache = int(video_count * average_tokens * T5_HIDDEN_SIZE * CACHE_BYTES_PER_VALUE)
+    stages = [
+        ("1. Download + extração do dataset", extracted_bytes, download_bytes,
+         download_bytes / 1024**2 / rates["dataset_download_mbps"] + extracted_bytes / 1024**2 / rates["extract_mbps"]),
+        ("2. Download dos modelos", model_bytes, 0,
+         model_bytes / 1024**2 / rates["model_download_mbps"]),
+        ("3. Legendas (wd-llm-caption)", video_count * FRAME_BYTES + caption_tool_bytes, 0,
+         video_count / rates["caption_videos_per_s"]),
+        ("5. Pré-cache de latents (VAE)", latent_cache, 0,
+         video_count / rates["latent_videos_per_s"]),
+        ("5. Pré-cache do text encoder (T5)", t5_cache, 0,
+         video_count / rates["t5_captions_per_s"]),
+        ("6. Treinamento (LoRAs + estados)", saved_loras * lora_bytes + training.KEEP_LAST_N_STATES * state_bytes, state_bytes,
+         train_steps * rates["train_seconds_per_step"]),
+    ]
+    if args.snapshot:
+        stages.insert(5, ("5. Snapshot do pré-cache", latent_cache + t5_cache, 0, 0))
+
+    # --- Relatório ---
+    print(f"\n{'Etapa':<38}{'Disco':>12}{'Acumulado':>12}{'Pico':>12}{'Tempo':>12}")
+    cumulative = 0
+    peak = 0
+    total_time = 0
+    for name, kept, transient, seconds in stages:
+        stage_peak = cumulative + kept + transient
+        cumulative += kept
+        peak = max(peak, stage_peak)
+        total_time += seconds
+        print(f"{name:<38}{format_size(kept):>12}{format_size(cumulative):>12}{format_size(stage_peak):>12}{format_duration(seconds):>12}")
+    print("-" * 86)
+    print(f"{'Total':<38}{'':>12}{format_size(cumulative):>12}{format_size(peak):>12}{format_duration(total_time):>12}")
+
+    print("\nVazões usadas:")
+    for key, value in rates.items():
+        print(f"   {key:<24} {value:10.2f}  ({rate_sources[key]})")
+
+    if notes:
+        print("\nObservações:")
+        for note in notes:
+            print(f"   ℹ️  {note}")
+
+    usage_path = args.workspace if args.workspace.exists() else Path.cwd()
+    free = shutil.disk_usage(usage_path).free
+    available = free * (1 - SAFETY_MARGIN)
+    print(f"\nEspaço livre em '{usage_path}': {format_size(free).strip()} (usando {1 - SAFETY_MARGIN:.0%} como limite)")
+
+    if peak > available:
+        print(f"\n❌ ERRO: O pico estimado ({format_size(peak).strip()}) não cabe no espaço livre.")
+        print(f"   Faltam aproximadamente {format_size(peak - available).strip()}. Libere espaço ou aumente o volume antes de começar.")
+        sys.exit(1)
+
+    print(f"\n✅ O pipeline cabe no disco (folga de {format_size(available - peak).strip()}). Tempo total estimado: {format_duration(total_time).strip()}.")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Estima o uso de disco e o tempo de cada etapa antes de iniciar o pipeline.", formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument("zip_url", type=str, nargs="?", help="URL do .zip do dataset (mesma do passo 1).")
+    parser.add_argument("-m", "--manifest", type=str, help="Manifesto de URLs (mesmo formato do passo 1).")
+    parser.add_argument("--workspace", type=Path, default=WORKSPACE_DIR, help=f"Volume onde o pipeline grava os arquivos (padrão: {WORKSPACE_DIR})")
+    parser.add_argument("--dataset_toml", type=str, default="dataset.toml", help="Nome do dataset.toml dentro do workspace (padrão: dataset.toml)")
+    parser.add_argument("--task", choices=["i2v-14B", "t2v-14B"], default="i2v-14B", help="Tipo de treinamento (padrão: i2v-14B)")
+    parser.add_argument("--network_dim", type=str, help="Dimensão da LoRA (padrão: a do script de treinamento)")
+    parser.add_argument("--num_videos", type=int, help="Quantidade de vídeos, quando eles ainda não foram extraídos.")
+    parser.add_argument("--snapshot", action=argparse.BooleanOptionalAction, default=True, help="Considera o snapshot do pré-cache salvo pelo passo 5 (padrão: sim)")
+    parser.add_argument("--offline", action="store_true", help="Não consulta o Hugging Face; usa tamanhos conhecidos dos modelos.")
+    parser.add_argument("--measure_download", action="store_true", help="Mede a vazão real baixando os primeiros 32 MB da primeira URL.")
+    parser.add_argument("--benchmark_json", type=str, help="Relatório do benchmark_pipeline.py com vazões medidas.")
+    for key, default in DEFAULT_RATES.items():
+        parser.add_argument(f"--{key}", type=float, help=f"Vazão para '{key}' (padrão: {default})")
+    main(parser.parse_args())
@@ -1,8 +1,16 @@
 import os
 import sys
+import time
+import random
+import asyncio
+import hashlib
 import subprocess
+import threading
 import zipfile
 import argparse
+import importlib.util
+from urllib.parse import urlparse, unquote
+from concurrent.futures import ThreadPoolExecutor
 
 # --- INÍCIO DO BLOCO DE VERIFICAÇÃO DE DEPENDÊNCIAS ---
 def check_and_install_packages():
@@ -13,9 +21,8 @@ def check_and_install_packages():
     required_packages = ["requests", "tqdm"]
     
     for package in required_packages:
-        try:
-            __import__(package)
-        except ImportError:
+        # find_spec apenas localiza o pacote, sem o custo de importá-lo
+        if importlib.util.find_spec(package) is None:
             print(f"A biblioteca '{package}' não foi encontrada. Instalando automaticamente...")
             try:
                 subprocess.check_call([sys.executable, "-m", "pip", "install", package])
@@ -32,8 +39,16 @@ check_and_install_packages()
 
 # Agora que garantimos que os pacotes existem, podemos importá-los
 import requests
+from requests.adapters import HTTPAdapter
 from tqdm import tqdm
 
+# --- CONFIGURAÇÕES DO MODO MANIFESTO ---
+MANIFEST_CONCURRENCY = 8      # Downloads simultâneos
+MANIFEST_RETRIES = 4          # Tentativas extras por arquivo
+RETRY_BACKOFF_SECONDS = 2.0   # Espera base entre tentativas (dobra a cada falha)
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+EXTRACT_WORKERS = 2
+
 
 def download_file(url, destination_folder):
     """
@@ -80,6 +95,9 @@ def extract_zip(zip_path, extract_to_dir):
     Args:
         zip_path (str): O caminho para o arquivo .zip.
         extract_to_dir (str): O diretório onde o conteúdo será extraído.
+
+    Returns:
+        bool: True se a extração foi concluída.
     """
     try:
         print(f"Extraindo para o diretório: {extract_to_dir}")
@@ -87,10 +105,222 @@ def extract_zip(zip_path, extract_to_dir):
         with zipfile.ZipFile(zip_path, 'r') as zip_ref:
             zip_ref.extractall(extract_to_dir)
         print("Extração concluída.")
+        return True
     except zipfile.BadZipFile:
         print(f"Erro: O arquivo '{zip_path}' não é um arquivo zip válido.")
     except Exception as e:
         print(f"Ocorreu um erro durante a extração: {e}")
+    return False
+
+
+def filename_from_url(url):
+    """Extrai o nome do arquivo de uma URL, ignorando query string e fragmento."""
+    return unquote(os.path.basename(urlparse(url).path)) or "download"
+
+
+def parse_manifest(manifest_path):
+    """
+    Lê um manifesto de downloads, uma URL por linha, com campos opcionais:
+
+        https://exemplo.com/parte1.zip sha256=<hash> subdir=estilo_a
+        https://exemplo.com/video01.mp4 subdir=extras
+        # linhas iniciadas com '#' são ignoradas
+
+    Arquivos .zip são extraídos em <output_dir>/<subdir>; os demais são salvos lá diretamente,
+    então dois arquivos que não são .zip não podem ter o mesmo nome na mesma subpasta.
+
+    Returns:
+        list: Lista de dicts com 'url', 'sha256' e 'subdir'.
+    """
+    entries = []
+    destinations = {}
+    with open(manifest_path, 'r', encoding='utf-8') as f:
+        for line_number, line in enumerate(f, 1):
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            url, *options = line.split()
+            entry = {"url": url, "sha256": None, "subdir": ""}
+            for option in options:
+                key, sep, value = option.partition('=')
+                if not sep or key not in ("sha256", "subdir"):
+                    raise ValueError(f"Linha {line_number}: opção inválida '{option}'. Use sha256=<hash> ou subdir=<pasta>.")
+                entry[key] = value.lower() if key == "sha256" else value
+            filename = filename_from_url(url)
+            if not filename.lower().endswith(".zip"):
+                destination = os.path.normpath(os.path.join(entry["subdir"], filename))
+                if destination in destinations:
+                    raise ValueError(
+                        f"Linha {line_number}: '{destination}' já é o destino da linha {destinations[destination]}. "
+                        "Use um subdir= diferente."
+                    )
+                destinations[destination] = line_number
+            entries.append(entry)
+    return entries
+
+
+def create_pooled_session(pool_size):
+    """Cria uma sessão HTTP com pool de conexões keep-alive compartilhado entre os downloads."""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def download_to_path(session, url, filepath, progress, expected_sha256=None):
+    """
+    Baixa uma URL para 'filepath' usando a sessão compartilhada, validando o sha256 se informado.
+    O arquivo é gravado como '.part' e só é renomeado ao final, com sucesso.
+
+    Returns:
+        int: Número de bytes baixados.
+    """
+    part_path = filepath + ".part"
+    digest = hashlib.sha256()
+    downloaded = 0
+    try:
+        with session.get(url, stream=True, timeout=(10, 60)) as response:
+            response.raise_for_status()
+            with open(part_path, 'wb') as f:
+                for data in response.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+                    f.write(data)
+                    digest.update(data)
+                    downloaded += len(data)
+                    progress.update(len(data))
+
+        if expected_sha256 and digest.hexdigest() != expected_sha256:
+            raise ValueError(f"checksum sha256 não confere (esperado {expected_sha256}, obtido {digest.hexdigest()})")
+        os.replace(part_path, filepath)
+        return downloaded
+    except BaseException:
+        # Desconta o progresso da tentativa que falhou
+        progress.update(-downloaded)
+        if os.path.exists(part_path):
+            os.remove(part_path)
+        raise
+
+
+def is_retryable(error):
+    """Erros 4xx (exceto timeout e rate limit) não mudam numa nova tentativa."""
+    if isinstance(error, requests.exceptions.HTTPError) and error.response is not None:
+        status = error.response.status_code
+        return not (400 <= status < 500) or status in (408, 429)
+    return True
+
+
+async def download_manifest(entries, output_dir, download_folder, concurrency=MANIFEST_CONCURRENCY, retries=MANIFEST_RETRIES):
+    """
+    Baixa todas as entradas do manifesto com concorrência limitada, reutilizando conexões.
+    Cada .zip concluído é enviado para extração enquanto os outros downloads continuam.
+
+    Returns:
+        tuple: (bytes baixados, lista de (url, erro) que falharam)
+    """
+    loop = asyncio.get_running_loop()
+    semaphore = asyncio.Semaphore(concurrency)
+    session = create_pooled_session(concurrency)
+    download_pool = ThreadPoolExecutor(max_workers=concurrency)
+    extract_pool = ThreadPoolExecutor(max_workers=EXTRACT_WORKERS)
+    progress_lock = threading.Lock()
+    failures = []
+    total_bytes = 0
+
+    progress_bar = tqdm(desc="Total", unit='iB', unit_scale=True, unit_divisor=1024)
+
+    class Progress:
+        """Barra de progresso agregada, segura para uso entre threads."""
+        def update(self, n):
+            with progress_lock:
+                progress_bar.update(n)
+
+    progress = Progress()
+
+    async def process(index, entry):
+        nonlocal total_bytes
+        url = entry["url"]
+        filename = filename_from_url(url)
+        destination_dir = os.path.join(output_dir, entry["subdir"])
+        is_zip = filename.lower().endswith(".zip")
+        # Arquivos .zip vão para a pasta de download com um nome único por entrada
+        # (URLs diferentes podem terminar em 'parte.zip'); os demais, direto para o destino
+        if is_zip:
+            filepath = os.path.join(download_folder, f".manifest-{index:04d}-{filename}")
+        else:
+            filepath = os.path.join(destination_dir, filename)
+        os.makedirs(os.path.dirname(filepath) or ".", exist_ok=True)
+
+        async with semaphore:
+            for attempt in range(retries + 1):
+                try:
+                    size = await loop.run_in_executor(
+                        download_pool, download_to_path, session, url, filepath, progress, entry["sha256"]
+                    )
+                    total_bytes += size
+                    break
+                except (requests.exceptions.RequestException, ValueError, OSError) as e:
+                    if attempt == retries or not is_retryable(e):
+                        tqdm.write(f"❌ Falha definitiva em '{url}': {e}")
+                        failures.append((url, str(e)))
+                        return
+                    delay = RETRY_BACKOFF_SECONDS * (2 ** attempt) * random.uniform(0.8, 1.2)
+                    tqdm.write(f"⚠️  Erro em '{url}' ({e}). Nova tentativa em {delay:.1f}s...")
+                    await asyncio.sleep(delay)
+
+        # A extração roda fora do semáforo, liberando a vaga para o próximo download
+        if is_zip:
+            try:
+                await loop.run_in_executor(extract_pool, extract_and_remove_zip, filepath, destination_dir)
+            except ValueError as e:
+                tqdm.write(f"❌ Falha ao extrair '{url}': {e}")
+                failures.append((url, str(e)))
+
+    try:
+        await asyncio.gather(*(process(index, entry) for index, entry in enumerate(entries)))
+    finally:
+        progress_bar.close()
+        download_pool.shutdown()
+        extract_pool.shutdown()
+        session.close()
+    return total_bytes, failures
+
+
+def extract_and_remove_zip(zip_path, extract_to_dir):
+    """Extrai um .zip baixado e remove o arquivo em seguida. Gera ValueError se a extração falhar."""
+    extracted = extract_zip(zip_path, extract_to_dir)
+    try:
+        os.remove(zip_path)
+    except OSError as e:
+        print(f"Erro ao remover o arquivo .zip: {e}")
+    if not extracted:
+        raise ValueError(f"não foi possível extrair '{zip_path}'")
+
+
+def run_manifest(manifest_path, output_dir, concurrency):
+    """Executa o modo manifesto e exibe o resumo com a vazão agregada."""
+    try:
+        entries = parse_manifest(manifest_path)
+    except (OSError, ValueError) as e:
+        print(f"Erro ao ler o manifesto '{manifest_path}': {e}")
+        sys.exit(1)
+
+    if not entries:
+        print("O manifesto não contém nenhuma URL.")
+        return
+
+    print(f"Baixando {len(entries)} arquivos com até {concurrency} downloads simultâneos...")
+    start = time.perf_counter()
+    total_bytes, failures = asyncio.run(download_manifest(entries, output_dir, ".", concurrency))
+    elapsed = time.perf_counter() - start
+
+    print("\n=== Resumo do download ===")
+    print(f"Arquivos concluídos: {len(entries) - len(failures)}/{len(entries)}")
+    print(f"Total baixado: {total_bytes / 1024**2:.1f} MB em {elapsed:.1f}s ({total_bytes / 1024**2 / max(elapsed, 1e-9):.1f} MB/s)")
+    if failures:
+        print("Falhas:")
+        for url, error in failures:
+            print(f" - {url}: {error}")
+        sys.exit(1)
 
 
 def main():
@@ -103,8 +333,20 @@ def main():
     parser.add_argument(
         "zip_url", 
         type=str, 
+        nargs="?",
         help="A URL completa do arquivo .zip a ser baixado."
     )
+    parser.add_argument(
+        "-m", "--manifest",
+        type=str,
+        help="Arquivo com várias URLs (uma por linha, com 'sha256=' e 'subdir=' opcionais) para baixar em paralelo."
+    )
+    parser.add_argument(
+        "-j", "--concurrency",
+        type=int,
+        default=MANIFEST_CONCURRENCY,
+        help=f"Número de downloads simultâneos no modo manifesto (padrão: {MANIFEST_CONCURRENCY})."
+    )
     parser.add_argument(
         "-o", "--output_dir",
         type=str,
@@ -113,6 +355,13 @@ def main():
     )
 
     args = parser.parse_args()
+
+    if bool(args.zip_url) == bool(args.manifest):
+        parser.error("Informe uma URL de .zip ou um manifesto com --manifest (apenas um dos dois).")
+
+    if args.manifest:
+        run_manifest(args.manifest, args.output_dir, args.concurrency)
+        return
     
     # O diretório de destino agora é flexível, vindo dos argumentos.
     extract_destination = args.output_dir
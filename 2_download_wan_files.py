@@ -31,6 +31,7 @@ import os
 import sys
 import subprocess
 import shutil
+import importlib.util
 from pathlib import Path
 
 # --- PASTA DE DESTINO LOCAL ---
@@ -80,11 +81,10 @@ def check_and_install_dependencies():
     
     needs_install = False
     for import_name, install_name in packages.items():
-        try:
-            # Tenta importar o pacote para verificar se está instalado
-            __import__(import_name)
+        # Apenas localiza o pacote, sem o custo de importá-lo (huggingface_hub é pesado)
+        if importlib.util.find_spec(import_name) is not None:
             print(f"✅ '{install_name}' já está instalado.")
-        except ImportError:
+        else:
             print(f"⚠️  '{install_name}' não encontrado. Instalando...")
             try:
                 # Executa o pip install e mostra a saída para o usuário
@@ -1,9 +1,13 @@
 # 5_run_precaching.py
 # Versão corrigida para ambiente Runpod (sem venv)
 import sys
+import argparse
 import subprocess
 from pathlib import Path
 
+from precache_snapshot import DEFAULT_SNAPSHOT_DIR, compute_fingerprint, snapshot_path, read_dataset_dirs, create_snapshot, restore_snapshot
+from local_staging import default_stage_dir, local_path_for, rewrite_dataset_toml, start_staging, top_level_paths, BackgroundSync
+
 # --- CONFIGURAÇÕES ---
 # Nomes dos diretórios e arquivos que o script espera encontrar no /workspace
 REPO_DIR = "musubi-tuner-main"
@@ -46,7 +50,7 @@ def run_command_realtime(command, error_msg):
         print(f"❌ ERRO: Comando '{command[0]}' não encontrado.")
         sys.exit(1)
 
-def main():
+def main(args):
     """Função principal que orquestra as verificações e a execução dos scripts."""
     print("=" * 60)
     print("🚀 Iniciando Scripts de Pré-Cache do Musubi 🚀")
@@ -61,6 +65,35 @@ def main():
         f"Modelo CLIP ({CLIP_FILE})": workspace_dir / MODELS_DIR / CLIP_FILE,
         f"Modelo T5 ({T5_FILE})": workspace_dir / MODELS_DIR / T5_FILE,
     }
+    model_paths = [paths_to_check[f"Modelo VAE ({VAE_FILE})"], paths_to_check[f"Modelo CLIP ({CLIP_FILE})"], paths_to_check[f"Modelo T5 ({T5_FILE})"]]
+
+    # --- SNAPSHOT DO PRÉ-CACHE: restaura em vez de recalcular se nada mudou ---
+    snapshot_file = None
+    if not args.no_snapshot and all(path.exists() for path in paths_to_check.values()):
+        dataset_config_path = paths_to_check["Arquivo de configuração (dataset.toml)"]
+        fingerprint = compute_fingerprint(dataset_config_path, model_paths)
+        snapshot_file = snapshot_path(args.snapshot_dir, fingerprint)
+        print(f"\n🔑 Fingerprint do pré-cache: {fingerprint}")
+        if snapshot_file.exists():
+            print(f"   ♻️  Snapshot encontrado: '{snapshot_file}'. Restaurando em vez de recalcular...")
+            cache_dirs = [cache_dir for _, cache_dir in read_dataset_dirs(dataset_config_path)]
+            try:
+                files, size = restore_snapshot(snapshot_file, cache_dirs)
+                print(f"\n✅ {files} arquivos de cache ({size / 1024**2:.1f} MB) restaurados com sucesso!")
+                print("\nAgora você está pronto para iniciar o treinamento principal com '6_training.py'")
+                return
+            except (OSError, ValueError) as e:
+                print(f"   ⚠️  Falha ao restaurar o snapshot ({e}). O cache será recalculado.")
+
+    # --- STAGING PARA O DISCO LOCAL (em paralelo com as verificações) ---
+    staging = None
+    dataset_dirs = []
+    dataset_config_path = paths_to_check["Arquivo de configuração (dataset.toml)"]
+    if args.stage_dir and dataset_config_path.exists():
+        print(f"\n📦 Copiando modelos e dataset para o disco local em '{args.stage_dir}' (em segundo plano)...")
+        local_dataset_config = local_path_for(dataset_config_path, args.stage_dir)
+        dataset_dirs = rewrite_dataset_toml(dataset_config_path, args.stage_dir, local_dataset_config)
+        staging = start_staging(model_paths + dataset_dirs, args.stage_dir)
     
     print("\n🔍 Verificando se todos os arquivos e pastas necessários existem em /workspace...")
     all_ok = True
@@ -70,11 +103,31 @@ def main():
             all_ok = False
             
     if not all_ok:
+        if staging is not None:
+            staging.cancel()
         print("\nPor favor, execute os scripts anteriores ou verifique os nomes/locais dos arquivos.")
         sys.exit(1)
     
     print("   ✅ Todos os arquivos e pastas foram encontrados!")
 
+    # Caminhos efetivamente passados aos scripts do musubi
+    run_paths = dict(paths_to_check)
+    syncs = []
+    mapping = None
+    if staging is not None:
+        try:
+            mapping = staging.result()
+        except OSError as e:
+            # Ex: disco local cheio. O cache é gerado direto no /workspace
+            print(f"   ⚠️  Falha no staging para o disco local ({e}). Usando os caminhos do /workspace.")
+    if mapping is not None:
+        for name, path in paths_to_check.items():
+            if path.absolute() in mapping:
+                run_paths[name] = mapping[path.absolute()]
+        run_paths["Arquivo de configuração (dataset.toml)"] = local_dataset_config
+        # O cache gerado localmente volta para o /workspace em segundo plano
+        syncs = [BackgroundSync(mapping[d], d).start() for d in top_level_paths(dataset_dirs)]
+
     # --- PASSO 1: CACHE DE LATENTS (VAE + CLIP) ---
     print("\n" + "-" * 20 + " PASSO 1: Cache de Latents (VAE) " + "-" * 20)
     
@@ -82,9 +135,9 @@ def main():
     command1 = [
         "python", # Usa o python do ambiente do Pod
         latents_script_path,
-        "--dataset_config", str(paths_to_check["Arquivo de configuração (dataset.toml)"]),
-        "--vae", str(paths_to_check[f"Modelo VAE ({VAE_FILE})"]),
-        "--clip", str(paths_to_check[f"Modelo CLIP ({CLIP_FILE})"])
+        "--dataset_config", str(run_paths["Arquivo de configuração (dataset.toml)"]),
+        "--vae", str(run_paths[f"Modelo VAE ({VAE_FILE})"]),
+        "--clip", str(run_paths[f"Modelo CLIP ({CLIP_FILE})"])
     ]
     run_command_realtime(command1, "Falha ao executar o cache de latents.")
     print("\n✅ Cache de latents concluído com sucesso!")
@@ -96,13 +149,30 @@ def main():
     command2 = [
         "python", # Usa o python do ambiente do Pod
         text_encoder_script_path,
-        "--dataset_config", str(paths_to_check["Arquivo de configuração (dataset.toml)"]),
-        "--t5", str(paths_to_check[f"Modelo T5 ({T5_FILE})"]),
+        "--dataset_config", str(run_paths["Arquivo de configuração (dataset.toml)"]),
+        "--t5", str(run_paths[f"Modelo T5 ({T5_FILE})"]),
         "--batch_size", BATCH_SIZE
     ]
     run_command_realtime(command2, "Falha ao executar o cache do text encoder.")
     print("\n✅ Cache do text encoder concluído com sucesso!")
 
+    synced = True
+    if syncs:
+        print("\n🔄 Sincronizando o cache de volta para o /workspace...")
+        synced = all([sync.stop() for sync in syncs])
+
+    if snapshot_file is not None and not synced:
+        # O cache no /workspace está incompleto: um snapshot dele seria restaurado como válido
+        print("\n⚠️  O cache não foi sincronizado por completo para o /workspace. O snapshot não será salvo.")
+    elif snapshot_file is not None:
+        print(f"\n📦 Salvando snapshot do pré-cache em '{snapshot_file}'...")
+        cache_dirs = [cache_dir for _, cache_dir in read_dataset_dirs(paths_to_check["Arquivo de configuração (dataset.toml)"])]
+        try:
+            files, raw_size, archive_size = create_snapshot(cache_dirs, snapshot_file)
+            print(f"   ✅ Snapshot salvo ({files} arquivos, {raw_size / 1024**2:.1f} MB -> {archive_size / 1024**2:.1f} MB)")
+        except OSError as e:
+            print(f"   ⚠️  Não foi possível salvar o snapshot: {e}")
+
     # --- CONCLUSÃO ---
     print("\n" + "=" * 60)
     print("🎉 Scripts de pré-cache concluídos com sucesso! 🎉")
@@ -110,4 +180,8 @@ def main():
     print("\nAgora você está pronto para iniciar o treinamento principal com '6_training.py'")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Executa o pré-cache de latents e do text encoder do Musubi.", formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument("--stage_dir", type=Path, default=default_stage_dir(), help="Pasta no disco local (NVMe) para onde modelos e dataset são copiados antes do pré-cache.\nTambém pode ser definida pela variável WANTRAINITA_STAGE_DIR. (padrão: desativado)")
+    parser.add_argument("--snapshot_dir", type=Path, default=DEFAULT_SNAPSHOT_DIR, help=f"Pasta dos snapshots do pré-cache (padrão: {DEFAULT_SNAPSHOT_DIR})")
+    parser.add_argument("--no_snapshot", action="store_true", help="Não restaura nem salva snapshots; sempre recalcula o cache.")
+    main(parser.parse_args())
\ No newline at end of file
@@ -1,10 +1,16 @@
 # 6_training.py
 # Versão corrigida para ambiente Runpod (sem venv)
+import os
 import sys
+import shutil
+import signal
+import threading
 import subprocess
 import argparse
 from pathlib import Path
 
+from local_staging import default_stage_dir, local_path_for, rewrite_dataset_toml, start_staging, BackgroundSync
+
 # --- (‼️) CONFIGURAÇÃO PRINCIPAL - EDITE AQUI (‼️) ---
 # Coloque aqui o nome EXATO do arquivo do modelo DiT que você usa para este treino.
 DIT_MODEL_FILE = "wan2.1_t2v_14B_fp16.safetensors" # ⬅️⬅️⬅️ VERIFIQUE E EDITE ESTA LINHA SE NECESSÁRIO
@@ -23,6 +29,81 @@ SAVE_EVERY_N_EPOCHS = "4"
 #SAVE_EVERY_N_STEPS = "5" # Adicionado baseado no seu comando original
 SEED = "748"
 
+# Salvamento do estado completo (pesos + otimizador + scheduler) para retomar após preempção
+SAVE_STATE_EVERY_N_STEPS = "200"
+KEEP_LAST_N_STATES = 2 # Quantos estados completos (e LoRAs intermediárias por passo) manter em outputs/<nome>
+PRUNE_INTERVAL_SECONDS = 60
+# Arquivos que o accelerate grava por último; sem eles o estado está incompleto
+STATE_REQUIRED_FILES = ("optimizer.bin", "random_states_0.pkl")
+
+def list_training_states(output_dir):
+    """
+    Lista os diretórios de estado ('*-state') em output_dir.
+
+    Returns:
+        tuple: (estados válidos do mais antigo ao mais novo, estados incompletos)
+    """
+    valid, incomplete = [], []
+    if not output_dir.is_dir():
+        return valid, incomplete
+    for path in output_dir.iterdir():
+        if not path.is_dir() or not path.name.endswith("-state"):
+            continue
+        if all((path / name).is_file() for name in STATE_REQUIRED_FILES):
+            valid.append(path)
+        else:
+            incomplete.append(path)
+    valid.sort(key=lambda p: (p / STATE_REQUIRED_FILES[-1]).stat().st_mtime)
+    return valid, incomplete
+
+def list_step_loras(output_dir):
+    """Lista as LoRAs salvas a cada N passos ('<nome>-step00000200.safetensors'), da mais antiga à mais nova."""
+    if not output_dir.is_dir():
+        return []
+    # Pela data, como os estados: o número do passo recomeça em um treinamento do zero
+    return sorted(output_dir.glob("*-step*.safetensors"), key=lambda p: p.stat().st_mtime)
+
+def prune_training_states(output_dir, keep_last):
+    """Remove os estados e as LoRAs por passo antigos, mantendo apenas os 'keep_last' mais recentes."""
+    valid, incomplete = list_training_states(output_dir)
+    to_remove = valid[:-keep_last] if keep_last > 0 else []
+    # Estados incompletos mais antigos que o último válido são restos de gravações interrompidas
+    if valid:
+        newest_mtime = (valid[-1] / STATE_REQUIRED_FILES[-1]).stat().st_mtime
+        to_remove += [p for p in incomplete if p.stat().st_mtime < newest_mtime]
+    for path in to_remove:
+        shutil.rmtree(path, ignore_errors=True)
+        print(f"\n🧹 Estado antigo removido: '{path.name}'", flush=True)
+    # O '--save_every_n_steps' também grava uma LoRA a cada N passos; as de época não são tocadas
+    step_loras = list_step_loras(output_dir)
+    for path in step_loras[:-keep_last] if keep_last > 0 else []:
+        path.unlink(missing_ok=True)
+        print(f"\n🧹 LoRA intermediária removida: '{path.name}'", flush=True)
+
+def discard_previous_run(output_dir):
+    """
+    Remove os estados e as LoRAs por passo de um treinamento anterior, para que um
+    treinamento do zero não seja retomado nem podado com base nos arquivos antigos.
+    As LoRAs de época são mantidas (as novas sobrescrevem as de mesmo nome).
+    """
+    valid, incomplete = list_training_states(output_dir)
+    for path in valid + incomplete:
+        shutil.rmtree(path, ignore_errors=True)
+    for path in list_step_loras(output_dir):
+        path.unlink(missing_ok=True)
+    if valid or incomplete:
+        print(f"   🧹 {len(valid) + len(incomplete)} estados anteriores removidos de '{output_dir}'.")
+
+def start_state_pruner(output_dir, keep_last, stop_event):
+    """Inicia uma thread que aplica a política de retenção sem bloquear o treinamento."""
+    def loop():
+        while not stop_event.wait(PRUNE_INTERVAL_SECONDS):
+            prune_training_states(output_dir, keep_last)
+        prune_training_states(output_dir, keep_last)
+    thread = threading.Thread(target=loop, daemon=True)
+    thread.start()
+    return thread
+
 def run_command_realtime(command, error_msg):
     """Executa um comando e exibe sua saída em tempo real, linha por linha."""
     print(f"\n▶️  Iniciando o treinamento... O comando completo é:")
@@ -33,14 +114,32 @@ def run_command_realtime(command, error_msg):
     print("A saída do treinamento aparecerá abaixo. Pode levar um tempo para começar.")
     print("="*60 + "\n")
     
+    interrupted = threading.Event()
     try:
+        # Sessão própria para que o sinal chegue a todos os processos do accelerate
         process = subprocess.Popen(
             command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
-            text=True, encoding='utf-8', bufsize=1
+            text=True, encoding='utf-8', bufsize=1, start_new_session=True
         )
+
+        def forward_signal(signum, frame):
+            # Preempção (SIGTERM) ou Ctrl+C: encerra o treinamento de forma ordenada
+            if not interrupted.is_set():
+                print(f"\n⚠️  Sinal {signal.Signals(signum).name} recebido. Encerrando o treinamento...", flush=True)
+                interrupted.set()
+                try:
+                    os.killpg(process.pid, signal.SIGINT)
+                except ProcessLookupError:
+                    pass
+        signal.signal(signal.SIGTERM, forward_signal)
+        signal.signal(signal.SIGINT, forward_signal)
+
         for line in process.stdout:
             print(line, end='', flush=True)
         process.wait()
+        if interrupted.is_set():
+            print("\n⏸️  Treinamento interrompido. Execute o mesmo comando novamente para retomar do último estado salvo.")
+            sys.exit(143)
         if process.returncode != 0:
             raise subprocess.CalledProcessError(process.returncode, command)
     except subprocess.CalledProcessError as e:
@@ -64,17 +163,63 @@ def main(args):
     dataset_toml_path = workspace_dir / args.dataset_toml
     
     paths_to_check = { "Repositório Musubi": repo_path, "Modelo DiT": dit_model_path, "Dataset TOML": dataset_toml_path }
+    output_dir = workspace_dir / "outputs" / args.name
+
+    if args.no_resume:
+        # Também na cópia local de um staging anterior, que seria sincronizada de volta
+        discard_previous_run(output_dir)
+        if args.stage_dir:
+            discard_previous_run(local_path_for(output_dir, args.stage_dir))
+
+    # --- Staging para o disco local (em paralelo com as verificações) ---
+    staging = None
+    if args.stage_dir and dataset_toml_path.exists():
+        print(f"   📦 Copiando DiT, cache do dataset e saídas anteriores para '{args.stage_dir}' (em segundo plano)...")
+        local_dataset_toml = local_path_for(dataset_toml_path, args.stage_dir)
+        # O treinamento só lê o cache (latents + T5); os vídeos continuam no /workspace
+        cache_dirs = rewrite_dataset_toml(dataset_toml_path, args.stage_dir, local_dataset_toml, keys=("cache_directory",))
+        staging = start_staging([dit_model_path, output_dir, *cache_dirs], args.stage_dir)
+
     all_ok = True
     for name, path in paths_to_check.items():
         if not path.exists():
             print(f"   ❌ ERRO: {name} não encontrado em '{path}'"); all_ok = False
     if not all_ok:
+        if staging is not None:
+            staging.cancel()
         print("\nCertifique-se de que o nome do arquivo DIT_MODEL_FILE está correto no topo do script."); sys.exit(1)
         
-    output_dir = workspace_dir / "outputs" / args.name
     output_dir.mkdir(parents=True, exist_ok=True)
     print(f"   ✅ Ambiente verificado. A saída será salva em '{output_dir}'")
 
+    # Caminhos efetivamente usados pelo treinamento (locais, se houver staging)
+    run_dit_path, run_dataset_toml, run_output_dir = dit_model_path, dataset_toml_path, output_dir
+    output_sync = None
+    mapping = None
+    if staging is not None:
+        try:
+            mapping = staging.result()
+        except OSError as e:
+            # Ex: disco local cheio. O treinamento segue com os arquivos do /workspace
+            print(f"   ⚠️  Falha no staging para o disco local ({e}). Usando os caminhos do /workspace.")
+    if mapping is not None:
+        run_dit_path, run_dataset_toml = mapping[dit_model_path], local_dataset_toml
+        run_output_dir = mapping[output_dir]
+        run_output_dir.mkdir(parents=True, exist_ok=True)
+        # As saídas (LoRAs e estados) voltam para o /workspace em segundo plano
+        output_sync = BackgroundSync(run_output_dir, output_dir, delete=True).start()
+        print(f"   📦 Treinando a partir do disco local. Saída local: '{run_output_dir}'")
+
+    # --- Retomada automática ---
+    resume_args = []
+    if not args.no_resume:
+        valid_states, _ = list_training_states(run_output_dir)
+        if valid_states:
+            resume_args = ["--resume", str(valid_states[-1])]
+            print(f"   ♻️  Estado anterior encontrado. Retomando de '{valid_states[-1].name}'")
+        else:
+            print("   ℹ️  Nenhum estado anterior encontrado. Iniciando do zero.")
+
     # --- Construção do Comando ---
     train_script = str(repo_path / "src/musubi_tuner/wan_train_network.py")
     
@@ -85,25 +230,28 @@ def main(args):
         "accelerate", "launch", "--num_cpu_threads_per_process", "1", "--mixed_precision", "fp16",
         train_script,
         "--task", TASK,
-        "--dit", str(dit_model_path),
-        "--dataset_config", str(dataset_toml_path),
+        "--dit", str(run_dit_path),
+        "--dataset_config", str(run_dataset_toml),
         "--sdpa",
         "--split_attn",
         "--blocks_to_swap","16",
         "--optimizer_type", "came_pytorch.CAME.CAME",
-        "--learning_rate", LEARNING_RATE,
+        "--learning_rate", args.learning_rate,
         "--max_data_loader_n_workers", "2",
         "--mixed_precision", "fp16", 
         "--persistent_data_loader_workers",
         "--network_module", "networks.lora_wan",
-        "--network_dim", NETWORK_DIM,
-        "--network_alpha",NETWORK_DIM,
+        "--network_dim", args.network_dim,
+        "--network_alpha", args.network_dim,
         "--timestep_sampling", "shift",
         "--discrete_flow_shift", "3.5",
         "--max_train_epochs", MAX_TRAIN_EPOCHS,
         "--save_every_n_epochs", SAVE_EVERY_N_EPOCHS,
+        "--save_every_n_steps", SAVE_STATE_EVERY_N_STEPS,
+        "--save_state",
+        "--save_state_on_train_end",
         "--seed", SEED,
-        "--output_dir", str(output_dir),
+        "--output_dir", str(run_output_dir),
         "--output_name", args.name,
         "--network_args", "loraplus_lr_ratio=4",
         "--lr_scheduler", "constant_with_warmup",
@@ -111,11 +259,21 @@ def main(args):
         "--fp8_base",
         "--fp8_scaled",
         "--gradient_checkpointing",
+        *resume_args,
         "--optimizer_args", *optimizer_args_list # CORREÇÃO: Passando como argumentos separados
     ]
 
     # --- Execução ---
-    run_command_realtime(command, "Ocorreu um erro durante o treinamento.")
+    stop_pruner = threading.Event()
+    pruner = start_state_pruner(run_output_dir, args.keep_last_states, stop_pruner)
+    try:
+        run_command_realtime(command, "Ocorreu um erro durante o treinamento.")
+    finally:
+        stop_pruner.set()
+        pruner.join()
+        if output_sync is not None:
+            print("\n🔄 Sincronizando as saídas de volta para o /workspace...")
+            output_sync.stop()
     
     print("\n" + "=" * 60)
     print(f"🎉 Treinamento '{args.name}' concluído com sucesso! 🎉")
@@ -126,5 +284,10 @@ if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Inicia um treinamento de LoRA para Wan2.1 com configurações personalizadas.", formatter_class=argparse.RawTextHelpFormatter)
     parser.add_argument("name", type=str, help="O nome para esta sessão de treinamento.\nSerá usado para criar a pasta de saída e nomear os arquivos LoRA.")
     parser.add_argument("--dataset_toml", type=str, default="dataset.toml", help="Nome do arquivo de configuração do dataset .toml (padrão: dataset.toml)")
+    parser.add_argument("--network_dim", type=str, default=NETWORK_DIM, help=f"Dimensão (e alpha) da rede LoRA (padrão: {NETWORK_DIM})")
+    parser.add_argument("--learning_rate", type=str, default=LEARNING_RATE, help=f"Taxa de aprendizado (padrão: {LEARNING_RATE})")
+    parser.add_argument("--keep_last_states", type=int, default=KEEP_LAST_N_STATES, help=f"Quantos estados completos (e LoRAs salvas por passo) manter para retomada (padrão: {KEEP_LAST_N_STATES})")
+    parser.add_argument("--no_resume", action="store_true", help="Remove os estados e LoRAs por passo anteriores e inicia o treinamento do zero.")
+    parser.add_argument("--stage_dir", type=Path, default=default_stage_dir(), help="Pasta no disco local (NVMe) para onde DiT, dataset e saídas são copiados antes do treino.\nTambém pode ser definida pela variável WANTRAINITA_STAGE_DIR. (padrão: desativado)")
     parsed_args = parser.parse_args()
     main(parsed_args)
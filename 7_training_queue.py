@@ -0,0 +1,393 @@
+# 7_training_queue.py
+# Fila de treinamentos: executa vários '6_training*.py' em sequência ou em paralelo,
+# distribuindo os jobs entre "slots" de GPU via CUDA_VISIBLE_DEVICES.
+import os
+import sys
+import json
+import time
+import signal
+import hashlib
+import argparse
+import threading
+import subprocess
+import importlib.util
+from pathlib import Path
+
+from precache_snapshot import DEFAULT_DATASET_CONFIG, DEFAULT_MODEL_FILES, compute_fingerprint
+from local_staging import default_stage_dir, local_path_for
+
+# --- CONFIGURAÇÕES ---
+SCRIPT_DIR = Path(__file__).resolve().parent
+WORKSPACE_DIR = Path("/workspace")
+# O estado de cada fila fica ao lado do arquivo de jobs: jobs.json -> jobs.state.json
+STATE_FILE_SUFFIX = ".state.json"
+DEFAULT_LOGS_DIR = WORKSPACE_DIR / "outputs" / "queue_logs"
+
+# Qual launcher de treinamento usar para cada task
+TRAINING_SCRIPTS = {
+    "i2v-14B": SCRIPT_DIR / "6_trainingI2V.py",
+    "t2v-14B": SCRIPT_DIR / "6_trainingT2V.py",
+}
+PRECACHE_SCRIPT = SCRIPT_DIR / "5_run_precaching.py"
+
+# Estados possíveis de um job
+PENDING, RUNNING, DONE, FAILED = "pending", "running", "done", "failed"
+# Código de saída dos launchers de treinamento quando interrompidos por SIGTERM/Ctrl+C
+INTERRUPTED_EXIT_CODE = 143
+
+
+def load_jobs(jobs_file):
+    """
+    Lê o arquivo de jobs (JSON) e valida cada entrada.
+
+    O arquivo deve conter uma lista de objetos com os mesmos argumentos dos
+    scripts de treinamento, por exemplo:
+        [{"name": "estilo_a", "task": "i2v-14B", "network_dim": "32", "learning_rate": "6e-5"},
+         {"name": "estilo_b", "task": "t2v-14B", "dataset_toml": "dataset_b.toml"}]
+
+    Um job pode trazer um campo opcional "command" (lista) que substitui o comando
+    de treinamento gerado, útil para testar a fila com comandos de mentira.
+    """
+    with open(jobs_file, 'r', encoding='utf-8') as f:
+        raw_jobs = json.load(f)
+
+    if not isinstance(raw_jobs, list):
+        raise ValueError("O arquivo de jobs deve conter uma lista de objetos.")
+
+    jobs = []
+    seen_names = set()
+    for i, raw in enumerate(raw_jobs, 1):
+        if "name" not in raw:
+            raise ValueError(f"Job #{i} não possui o campo obrigatório 'name'.")
+        if raw["name"] in seen_names:
+            raise ValueError(f"Nome de job duplicado: '{raw['name']}'.")
+        seen_names.add(raw["name"])
+
+        job = {
+            "name": raw["name"],
+            "task": raw.get("task", "i2v-14B"),
+            "dataset_toml": raw.get("dataset_toml", "dataset.toml"),
+            "network_dim": str(raw["network_dim"]) if "network_dim" in raw else None,
+            "learning_rate": str(raw["learning_rate"]) if "learning_rate" in raw else None,
+            "command": raw.get("command"),
+        }
+        if job["command"] is None and job["task"] not in TRAINING_SCRIPTS:
+            raise ValueError(
+                f"Task inválida '{job['task']}' no job '{job['name']}'. "
+                f"Use uma de: {', '.join(TRAINING_SCRIPTS)}."
+            )
+        jobs.append(job)
+    return jobs
+
+
+def default_state_file(jobs_file):
+    """Arquivo de estado padrão da fila, derivado do arquivo de jobs."""
+    jobs_file = Path(jobs_file)
+    return jobs_file.with_name(jobs_file.stem + STATE_FILE_SUFFIX)
+
+
+def dataset_fingerprint(dataset_toml, model_files=()):
+    """
+    Fingerprint do dataset.toml e dos vídeos/legendas que ele referencia
+    (o mesmo usado pelos snapshots do pré-cache). None se o TOML não existir.
+    """
+    dataset_path = WORKSPACE_DIR / dataset_toml
+    if not dataset_path.exists():
+        return None
+    return compute_fingerprint(dataset_path, model_files)
+
+
+def job_hashes(jobs):
+    """
+    Calcula o hash de cada job: a especificação completa + o fingerprint do dataset.
+    Um job com o mesmo nome, mas outra configuração ou outro dataset, é outro treinamento.
+    """
+    fingerprints = {}
+    hashes = {}
+    for job in jobs:
+        if job["dataset_toml"] not in fingerprints:
+            fingerprints[job["dataset_toml"]] = dataset_fingerprint(job["dataset_toml"])
+        payload = json.dumps({"spec": job, "dataset": fingerprints[job["dataset_toml"]]}, sort_keys=True)
+        hashes[job["name"]] = hashlib.sha256(payload.encode()).hexdigest()[:16]
+    return hashes
+
+
+def precache_hash():
+    """Hash das entradas do pré-cache compartilhado (dataset.toml, vídeos e modelos)."""
+    return dataset_fingerprint(DEFAULT_DATASET_CONFIG, DEFAULT_MODEL_FILES)
+
+
+def discard_previous_run(job):
+    """
+    Remove os estados e as LoRAs por passo de uma configuração anterior do job (no
+    /workspace e na cópia local do staging), para que ele não seja retomado a partir deles.
+    """
+    script = TRAINING_SCRIPTS.get(job["task"])
+    if script is None:
+        return
+    spec = importlib.util.spec_from_file_location("training_" + job["task"].replace("-", "_"), script)
+    training = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(training)
+
+    output_dir = WORKSPACE_DIR / "outputs" / job["name"]
+    training.discard_previous_run(output_dir)
+    stage_dir = default_stage_dir()
+    if stage_dir:
+        training.discard_previous_run(local_path_for(output_dir, stage_dir))
+
+
+def build_command(job):
+    """Monta o comando que executa o script de treinamento correspondente ao job."""
+    if job["command"]:
+        return [str(c) for c in job["command"]]
+
+    command = [
+        sys.executable, str(TRAINING_SCRIPTS[job["task"]]),
+        job["name"],
+        "--dataset_toml", job["dataset_toml"],
+    ]
+    if job["network_dim"] is not None:
+        command += ["--network_dim", job["network_dim"]]
+    if job["learning_rate"] is not None:
+        command += ["--learning_rate", job["learning_rate"]]
+    return command
+
+
+class QueueState:
+    """
+    Estado persistente da fila, salvo em JSON a cada mudança para que um pod
+    reiniciado continue de onde parou.
+    """
+
+    def __init__(self, state_file, jobs, hashes):
+        self.state_file = Path(state_file)
+        self.lock = threading.Lock()
+        self.data = {"precache_done": False, "jobs": {}}
+
+        if self.state_file.exists():
+            with open(self.state_file, 'r', encoding='utf-8') as f:
+                self.data = json.load(f)
+
+        # Sincroniza os jobs do arquivo com o estado salvo (novos jobs entram como pendentes)
+        self.order = [job["name"] for job in jobs]
+        self.specs = {job["name"]: job for job in jobs}
+        for name in self.order:
+            entry = self.data["jobs"].get(name)
+            if entry is not None and entry.get("spec_hash") != hashes[name]:
+                # Mesmo nome, outra configuração ou outro dataset: começa do zero. Os estados
+                # antigos são removidos antes de gravar o novo hash, então uma queda aqui só
+                # faz a limpeza se repetir na próxima execução.
+                print(f"   🔁 Job '{name}' mudou desde a última execução (configuração ou dataset). Voltando para a fila.")
+                discard_previous_run(self.specs[name])
+                entry = {"status": PENDING}
+            elif entry is None:
+                entry = {"status": PENDING}
+            entry["spec_hash"] = hashes[name]
+            self.data["jobs"][name] = entry
+            # Jobs que estavam rodando quando o pod caiu voltam para a fila
+            if entry["status"] == RUNNING:
+                print(f"   ♻️  Job '{name}' foi interrompido anteriormente. Voltando para a fila.")
+                entry["status"] = PENDING
+        self.save()
+
+    def save(self):
+        """Grava o estado de forma atômica (arquivo temporário + rename)."""
+        self.state_file.parent.mkdir(parents=True, exist_ok=True)
+        tmp_file = self.state_file.with_suffix(self.state_file.suffix + ".tmp")
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            json.dump(self.data, f, indent=2, ensure_ascii=False)
+        os.replace(tmp_file, self.state_file)
+
+    def reset_failed(self):
+        with self.lock:
+            for name in self.order:
+                if self.data["jobs"][name]["status"] == FAILED:
+                    self.data["jobs"][name]["status"] = PENDING
+            self.save()
+
+    def claim_next(self, slot):
+        """Reserva o próximo job pendente para o slot informado."""
+        with self.lock:
+            for name in self.order:
+                entry = self.data["jobs"][name]
+                if entry["status"] == PENDING:
+                    entry.update(status=RUNNING, slot=slot, started_at=time.time())
+                    entry.pop("returncode", None)
+                    self.save()
+                    return self.specs[name]
+            return None
+
+    def finish(self, name, returncode):
+        with self.lock:
+            entry = self.data["jobs"][name]
+            entry.update(
+                status=DONE if returncode == 0 else FAILED,
+                returncode=returncode,
+                finished_at=time.time(),
+            )
+            self.save()
+
+    def precache_is_current(self, inputs_hash):
+        """O pré-cache só é reutilizado se foi feito com as mesmas entradas."""
+        return self.data.get("precache_done") and self.data.get("precache_hash") == inputs_hash
+
+    def mark_precache_done(self, inputs_hash):
+        with self.lock:
+            self.data.update(precache_done=True, precache_hash=inputs_hash)
+            self.save()
+
+    def summary(self):
+        with self.lock:
+            return {name: self.data["jobs"][name]["status"] for name in self.order}
+
+
+def run_job(job, slot, logs_dir, processes):
+    """Executa um job no slot de GPU informado, exibindo a saída com prefixo e salvando em log."""
+    command = build_command(job)
+    env = os.environ.copy()
+    env["CUDA_VISIBLE_DEVICES"] = slot
+
+    log_path = Path(logs_dir) / f"{job['name']}.log"
+    log_path.parent.mkdir(parents=True, exist_ok=True)
+    prefix = f"[{job['name']} | GPU {slot}]"
+
+    print(f"\n▶️  {prefix} Iniciando: {' '.join(command)}", flush=True)
+    try:
+        process = subprocess.Popen(
+            command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+            text=True, encoding='utf-8', bufsize=1, env=env
+        )
+    except FileNotFoundError:
+        print(f"❌ {prefix} ERRO: Comando '{command[0]}' não encontrado.", flush=True)
+        return 127
+
+    processes[job["name"]] = process
+    with open(log_path, 'a', encoding='utf-8') as log_file:
+        for line in process.stdout:
+            log_file.write(line)
+            print(f"{prefix} {line}", end='', flush=True)
+        process.wait()
+    processes.pop(job["name"], None)
+    return process.returncode
+
+
+def slot_worker(slot, state, logs_dir, processes, stop_event):
+    """Loop de um slot: pega o próximo job pendente até a fila esvaziar."""
+    while not stop_event.is_set():
+        job = state.claim_next(slot)
+        if job is None:
+            return
+        returncode = run_job(job, slot, logs_dir, processes)
+        if stop_event.is_set():
+            # Interrompido (usuário ou preempção): mantém o job como 'running' para ser retomado
+            return
+        state.finish(job["name"], returncode)
+        if returncode == 0:
+            print(f"\n✅ [{job['name']}] Concluído com sucesso (GPU {slot}).", flush=True)
+        elif returncode == INTERRUPTED_EXIT_CODE:
+            # O launcher foi interrompido por fora da fila: o slot segue com os próximos jobs
+            print(f"\n⏸️  [{job['name']}] Interrompido externamente (GPU {slot}). Marcado como falho; use --retry_failed para retomá-lo.", flush=True)
+        else:
+            print(f"\n❌ [{job['name']}] Falhou com código {returncode} (GPU {slot}). Log: {Path(logs_dir) / (job['name'] + '.log')}", flush=True)
+
+
+def run_precache_once(state):
+    """Executa o pré-cache compartilhado uma única vez para todos os jobs da fila."""
+    inputs_hash = precache_hash()
+    if inputs_hash is not None and state.precache_is_current(inputs_hash):
+        print("   ✅ Pré-cache já executado anteriormente. Reutilizando o cache existente.")
+        return
+    if state.data.get("precache_done"):
+        print("   🔁 O dataset ou os modelos mudaram desde o último pré-cache. Recalculando...")
+    print("\n" + "-" * 20 + " Pré-cache compartilhado " + "-" * 20)
+    result = subprocess.run([sys.executable, str(PRECACHE_SCRIPT)])
+    if result.returncode != 0:
+        print("\n❌ ERRO: O pré-cache falhou. A fila não será iniciada.")
+        sys.exit(1)
+    state.mark_precache_done(precache_hash())
+
+
+def main(args):
+    """Função principal que carrega a fila e distribui os jobs entre os slots."""
+    print("=" * 60)
+    print("🚀 Iniciando Fila de Treinamentos de LoRA 🚀")
+    print("=" * 60)
+
+    try:
+        jobs = load_jobs(args.jobs_file)
+    except (OSError, ValueError) as e:
+        print(f"❌ ERRO ao ler o arquivo de jobs '{args.jobs_file}': {e}")
+        sys.exit(1)
+
+    state_file = args.state_file or default_state_file(args.jobs_file)
+    state = QueueState(state_file, jobs, job_hashes(jobs))
+    if args.retry_failed:
+        state.reset_failed()
+
+    pending = [name for name, status in state.summary().items() if status == PENDING]
+    print(f"\n📋 {len(jobs)} jobs no arquivo, {len(pending)} pendentes.")
+    print(f"   Slots de GPU: {', '.join(args.slots)}")
+    print(f"   Estado salvo em: '{Path(state_file).resolve()}'")
+
+    if not pending:
+        print("\nNada a fazer. Use --retry_failed para executar novamente os jobs que falharam.")
+        if any(status != DONE for status in state.summary().values()):
+            sys.exit(1)
+        return
+
+    if args.precache:
+        run_precache_once(state)
+
+    # Preempção do pod: trata SIGTERM como Ctrl+C para encerrar os jobs de forma ordenada
+    def handle_sigterm(signum, frame):
+        raise KeyboardInterrupt
+    signal.signal(signal.SIGTERM, handle_sigterm)
+
+    processes = {}
+    stop_event = threading.Event()
+    workers = [
+        threading.Thread(target=slot_worker, args=(slot, state, args.logs_dir, processes, stop_event), daemon=True)
+        for slot in args.slots
+    ]
+    for worker in workers:
+        worker.start()
+
+    try:
+        for worker in workers:
+            while worker.is_alive():
+                worker.join(timeout=1)
+    except KeyboardInterrupt:
+        print("\n\nInterrompido pelo usuário. Encerrando os treinamentos em andamento...")
+        stop_event.set()
+        for process in list(processes.values()):
+            process.terminate()
+        for worker in workers:
+            # Dá tempo para os launchers encerrarem o treinamento
+            worker.join(timeout=120)
+        print("Os jobs interrompidos serão retomados na próxima execução.")
+        sys.exit(130)
+
+    # --- CONCLUSÃO ---
+    summary = state.summary()
+    print("\n" + "=" * 60)
+    print("📊 Resumo da fila:")
+    for name, status in summary.items():
+        icon = {DONE: "✅", FAILED: "❌"}.get(status, "⏸️ ")
+        print(f"   {icon} {name}: {status}")
+    print("=" * 60)
+
+    # Qualquer job não concluído (falho ou ainda pendente) torna a fila malsucedida
+    if any(status != DONE for status in summary.values()):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Executa uma fila de treinamentos de LoRA distribuídos entre GPUs.", formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument("jobs_file", type=str, help="Arquivo JSON com a lista de jobs (name, task, dataset_toml, network_dim, learning_rate).")
+    parser.add_argument("--slots", type=str, nargs="+", default=["0"], help="Slots de GPU, um valor de CUDA_VISIBLE_DEVICES por slot.\nEx: '--slots 0 1' executa 2 jobs em paralelo; '--slots 0,1' usa 2 GPUs por job.\n(padrão: 0, ou seja, um job por vez)")
+    parser.add_argument("--state_file", type=str, default=None, help=f"Arquivo onde o estado da fila é salvo\n(padrão: ao lado do arquivo de jobs, ex: jobs.json -> jobs{STATE_FILE_SUFFIX})")
+    parser.add_argument("--logs_dir", type=str, default=str(DEFAULT_LOGS_DIR), help=f"Pasta para os logs de cada job (padrão: {DEFAULT_LOGS_DIR})")
+    parser.add_argument("--precache", action="store_true", help="Executa '5_run_precaching.py' uma única vez antes da fila.\nTodos os jobs reutilizam o mesmo cache.")
+    parser.add_argument("--retry_failed", action="store_true", help="Coloca novamente na fila os jobs que falharam.")
+    parsed_args = parser.parse_args()
+    main(parsed_args)
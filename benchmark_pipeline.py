@@ -0,0 +1,456 @@
+# benchmark_pipeline.py
+# Benchmark reproduzível das etapas do pipeline sobre datasets sintéticos.
+# Mede vazão e pico de memória de cada etapa, salva em JSON e compara dois resultados
+# para apontar regressões entre commits.
+#
+# Uso:
+#   python benchmark_pipeline.py run -o bench_base.json
+#   python benchmark_pipeline.py run -o bench_novo.json --captions 100000
+#   python benchmark_pipeline.py compare bench_base.json bench_novo.json
+import os
+import re
+import sys
+import json
+import time
+import random
+import struct
+import shutil
+import zipfile
+import platform
+import argparse
+import tempfile
+import queue as queue_module
+import resource
+import importlib.util
+import subprocess
+import threading
+import multiprocessing
+from contextlib import redirect_stdout, redirect_stderr
+from functools import partial
+from http.server import ThreadingHTTPServer, SimpleHTTPRequestHandler
+from pathlib import Path
+
+# --- CONFIGURAÇÕES ---
+SCRIPT_DIR = Path(__file__).resolve().parent
+DEFAULT_VIDEOS = 50
+DEFAULT_VIDEO_SIZE = 256 * 1024
+DEFAULT_CAPTIONS = 10000
+DEFAULT_DOWNLOAD_SIZE = 64 * 1024 * 1024
+DEFAULT_STREAM_LINES = 200000
+DEFAULT_CACHE_FILES = 200
+DEFAULT_REPEAT = 3
+DEFAULT_THRESHOLD = 0.10 # 10% de piora já é considerado regressão
+SEED = 748
+CHILD_POLL_SECONDS = 1.0
+
+
+def load_script(filename, module_name):
+    """Importa um dos scripts numerados do pipeline (ex: '4_create_dataset_toml.py')."""
+    sys.path.insert(0, str(SCRIPT_DIR))
+    spec = importlib.util.spec_from_file_location(module_name, SCRIPT_DIR / filename)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+# --- GERADORES DE DADOS SINTÉTICOS ---
+
+def make_fake_videos(folder, count, size, rng):
+    """Cria 'count' arquivos .mp4 com bytes aleatórios (para etapas que não decodificam vídeo)."""
+    folder.mkdir(parents=True, exist_ok=True)
+    for i in range(count):
+        (folder / f"video_{i:05d}.mp4").write_bytes(rng.randbytes(size))
+
+
+def make_real_videos(folder, count, cv2):
+    """Cria vídeos curtos de verdade com OpenCV (para a extração de frames)."""
+    import numpy as np
+    folder.mkdir(parents=True, exist_ok=True)
+    fourcc = cv2.VideoWriter_fourcc(*"mp4v")
+    for i in range(count):
+        writer = cv2.VideoWriter(str(folder / f"video_{i:05d}.mp4"), fourcc, 30.0, (256, 256))
+        for frame_index in range(8):
+            writer.write(np.full((256, 256, 3), (i * 7 + frame_index) % 256, dtype=np.uint8))
+        writer.release()
+
+
+def make_zip(zip_path, source_folder):
+    """Compacta a pasta em um .zip (sem compressão, como vídeos costumam vir)."""
+    with zipfile.ZipFile(zip_path, 'w', compression=zipfile.ZIP_STORED) as zf:
+        for path in sorted(source_folder.iterdir()):
+            zf.write(path, path.name)
+
+
+def make_captions(folder, count, rng):
+    """Cria 'count' legendas no formato gerado pelo Florence (com as frases que a limpeza remove)."""
+    folder.mkdir(parents=True, exist_ok=True)
+    words = ["woman", "man", "walking", "street", "red", "dress", "night", "city", "lights", "smiling"]
+    for i in range(count):
+        text = "The image shows " + " ".join(rng.choice(words) for _ in range(20))
+        (folder / f"video_{i:06d}.txt").write_text(text + "\n", encoding='utf-8')
+
+
+def make_fake_safetensors(path, tensor_bytes, rng):
+    """Cria um .safetensors com cabeçalho válido e payload aleatório, como os arquivos do cache."""
+    elements = tensor_bytes // 2
+    header = json.dumps({
+        "latents_1x16x21x64x64_bf16": {"dtype": "BF16", "shape": [elements], "data_offsets": [0, elements * 2]},
+        "__metadata__": {"architecture": "wan", "format_version": "1.0.1"},
+    }).encode()
+    header += b" " * (-len(header) % 8)
+    with open(path, 'wb') as f:
+        f.write(struct.pack("<Q", len(header)))
+        f.write(header)
+        f.write(rng.randbytes(elements * 2))
+
+
+def extract_heredoc_script(shell_script, marker="EOF"):
+    """Extrai o script Python embutido (heredoc) no wd_caption_installer.sh."""
+    content = Path(shell_script).read_text(encoding='utf-8')
+    match = re.search(rf"<< '{marker}'\n(.*?)\n{marker}\n", content, flags=re.DOTALL)
+    if not match:
+        raise ValueError(f"Heredoc '{marker}' não encontrado em '{shell_script}'.")
+    return match.group(1)
+
+
+class QuietHTTPRequestHandler(SimpleHTTPRequestHandler):
+    """Servidor local com keep-alive e sem log por requisição."""
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+
+class SkipBenchmark(Exception):
+    """A etapa não pode ser medida neste ambiente (ex: dependência opcional ausente)."""
+
+
+# --- BENCHMARKS (cada um roda em um processo separado) ---
+# Cada etapa tem duas funções:
+#   prepare_*(workdir, params) roda no processo principal e gera as entradas sintéticas
+#     (e, no download, sobe o servidor HTTP), para que nada disso entre no pico de memória.
+#     Retorna (contexto, função de limpeza ou None).
+#   bench_*(workdir, params, context) roda no processo medido e retorna (segundos, itens, bytes).
+
+def prepare_download_file(workdir, params):
+    served = workdir / "served"
+    served.mkdir()
+    rng = random.Random(SEED)
+    with open(served / "payload.bin", 'wb') as f:
+        for offset in range(0, params["download_size"], 1024 * 1024):
+            f.write(rng.randbytes(min(1024 * 1024, params["download_size"] - offset)))
+    server = ThreadingHTTPServer(("127.0.0.1", 0), partial(QuietHTTPRequestHandler, directory=str(served)))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    def cleanup():
+        server.shutdown()
+        server.server_close()
+    return {"url": f"http://127.0.0.1:{server.server_address[1]}/payload.bin"}, cleanup
+
+
+def bench_download_file(workdir, params, context):
+    module = load_script("1_download_and_extract_zip.py", "download_and_extract_zip")
+    target = workdir / "downloaded"
+    target.mkdir()
+    start = time.perf_counter()
+    result = module.download_file(context["url"], str(target))
+    elapsed = time.perf_counter() - start
+    if result is None:
+        raise RuntimeError("download_file retornou None")
+    return elapsed, 1, params["download_size"]
+
+
+def prepare_extract_zip(workdir, params):
+    make_fake_videos(workdir / "src", params["videos"], params["video_size"], random.Random(SEED))
+    make_zip(workdir / "dataset.zip", workdir / "src")
+    return {}, None
+
+
+def bench_extract_zip(workdir, params, context):
+    module = load_script("1_download_and_extract_zip.py", "download_and_extract_zip")
+    start = time.perf_counter()
+    if not module.extract_zip(str(workdir / "dataset.zip"), str(workdir / "out")):
+        raise RuntimeError("extract_zip falhou")
+    elapsed = time.perf_counter() - start
+    return elapsed, params["videos"], params["videos"] * params["video_size"]
+
+
+def prepare_frame_extraction(workdir, params):
+    try:
+        import cv2
+    except ImportError:
+        raise SkipBenchmark("OpenCV (cv2) não está instalado")
+    make_real_videos(workdir / "videos", params["videos"], cv2)
+    (workdir / "extract_frames.py").write_text(extract_heredoc_script(SCRIPT_DIR / "wd_caption_installer.sh"), encoding='utf-8')
+    return {}, None
+
+
+def bench_frame_extraction(workdir, params, context):
+    size = sum(p.stat().st_size for p in (workdir / "videos").iterdir())
+    start = time.perf_counter()
+    subprocess.run([sys.executable, str(workdir / "extract_frames.py"), str(workdir / "videos"), str(workdir / "frames")], check=True, stdout=subprocess.DEVNULL)
+    elapsed = time.perf_counter() - start
+    return elapsed, params["videos"], size
+
+
+def prepare_caption_postprocess(workdir, params):
+    make_captions(workdir / "captions", params["captions"], random.Random(SEED))
+    # Carrega as funções do script sem executar o 'main' do final
+    content = (SCRIPT_DIR / "wd_caption_installer.sh").read_text(encoding='utf-8')
+    (workdir / "functions.sh").write_text(re.sub(r'^main "\$@"\s*$', '', content, flags=re.MULTILINE), encoding='utf-8')
+    return {}, None
+
+
+def bench_caption_postprocess(workdir, params, context):
+    """Executa cleanup_captions e add_token_to_captions do wd_caption_installer.sh."""
+    captions = workdir / "captions"
+    size = sum(p.stat().st_size for p in captions.iterdir())
+    command = f'source "{workdir / "functions.sh"}"; VIDEO_PATH="{captions}"; TOKEN="bench_token"; cleanup_captions; add_token_to_captions'
+    start = time.perf_counter()
+    subprocess.run(["bash", "-c", command], check=True, stdout=subprocess.DEVNULL)
+    elapsed = time.perf_counter() - start
+    return elapsed, params["captions"], size
+
+
+def bench_create_dataset_toml(workdir, params, context):
+    module = load_script("4_create_dataset_toml.py", "create_dataset_toml")
+    os.chdir(workdir)
+    iterations = 1000
+    start = time.perf_counter()
+    for _ in range(iterations):
+        module.create_dataset_toml("[512, 512]", "[1, 25, 45]", 30.0, "videos_dataset")
+    elapsed = time.perf_counter() - start
+    return elapsed, iterations, iterations * Path("dataset.toml").stat().st_size
+
+
+def bench_run_command_realtime(workdir, params, context):
+    module = load_script("5_run_precaching.py", "run_precaching")
+    lines = params["stream_lines"]
+    line = "x" * 79
+    command = [sys.executable, "-c", f"import sys\nfor i in range({lines}): sys.stdout.write({line!r} + '\\n')"]
+    start = time.perf_counter()
+    module.run_command_realtime(command, "Falha no benchmark.")
+    elapsed = time.perf_counter() - start
+    return elapsed, lines, lines * (len(line) + 1)
+
+
+def prepare_precache_snapshot(workdir, params):
+    rng = random.Random(SEED)
+    cache = workdir / "cache"
+    cache.mkdir()
+    for i in range(params["cache_files"]):
+        make_fake_safetensors(cache / f"video_{i:05d}_wan.safetensors", 256 * 1024, rng)
+    return {}, None
+
+
+def bench_precache_snapshot(workdir, params, context):
+    """Cria e restaura um snapshot de pré-cache com arquivos .safetensors sintéticos."""
+    module = load_script("precache_snapshot.py", "precache_snapshot")
+    cache = workdir / "cache"
+    size = sum(p.stat().st_size for p in cache.iterdir())
+    archive = workdir / "snapshot.wcache"
+    start = time.perf_counter()
+    module.create_snapshot([cache], archive)
+    shutil.rmtree(cache)
+    module.restore_snapshot(archive, [cache])
+    elapsed = time.perf_counter() - start
+    return elapsed, params["cache_files"], size
+
+
+def prepare_nothing(workdir, params):
+    return {}, None
+
+
+# nome: (preparação no processo principal, etapa medida)
+BENCHMARKS = {
+    "download_file": (prepare_download_file, bench_download_file),
+    "extract_zip": (prepare_extract_zip, bench_extract_zip),
+    "frame_extraction": (prepare_frame_extraction, bench_frame_extraction),
+    "caption_postprocess": (prepare_caption_postprocess, bench_caption_postprocess),
+    "create_dataset_toml": (prepare_nothing, bench_create_dataset_toml),
+    "run_command_realtime": (prepare_nothing, bench_run_command_realtime),
+    "precache_snapshot": (prepare_precache_snapshot, bench_precache_snapshot),
+}
+
+
+def _child(name, workdir, params, context, queue):
+    """Executa apenas a etapa medida e reporta tempo, volume e pico de memória (RSS)."""
+    try:
+        with open(os.devnull, 'w') as devnull, redirect_stdout(devnull), redirect_stderr(devnull):
+            elapsed, items, size = BENCHMARKS[name][1](workdir, params, context)
+        # ru_maxrss está em KB no Linux; inclui subprocessos (bash, extração de frames)
+        peak_kb = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss, resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+        queue.put({"status": "ok", "seconds": elapsed, "items": items, "bytes": size, "peak_rss_mb": peak_kb / 1024})
+    except Exception as e:
+        queue.put({"status": "error", "reason": f"{type(e).__name__}: {e}"})
+
+
+def wait_for_child(process, queue):
+    """
+    Aguarda o resultado do processo medido. Se ele morrer sem reportar nada
+    (ex: OOM killer), retorna um erro em vez de bloquear para sempre.
+    """
+    while True:
+        try:
+            return queue.get(timeout=CHILD_POLL_SECONDS)
+        except queue_module.Empty:
+            if not process.is_alive():
+                # O resultado pode ter chegado entre o timeout e a verificação
+                try:
+                    return queue.get(timeout=CHILD_POLL_SECONDS)
+                except queue_module.Empty:
+                    return {"status": "error", "reason": f"exit code {process.exitcode}"}
+
+
+def run_benchmark(name, params, repeat):
+    """
+    Executa o benchmark 'repeat' vezes e guarda a melhor execução. As entradas são
+    geradas aqui, e só a etapa roda em um processo novo a cada vez.
+    """
+    context_mp = multiprocessing.get_context("spawn")
+    prepare = BENCHMARKS[name][0]
+    best = None
+    for _ in range(repeat):
+        workdir = Path(tempfile.mkdtemp(prefix=f"bench_{name}_"))
+        cleanup = None
+        try:
+            try:
+                with open(os.devnull, 'w') as devnull, redirect_stdout(devnull):
+                    context, cleanup = prepare(workdir, params)
+            except SkipBenchmark as e:
+                return {"status": "skipped", "reason": str(e)}
+            queue = context_mp.Queue()
+            process = context_mp.Process(target=_child, args=(name, workdir, params, context, queue))
+            process.start()
+            result = wait_for_child(process, queue)
+            process.join()
+        finally:
+            if cleanup is not None:
+                cleanup()
+            shutil.rmtree(workdir, ignore_errors=True)
+        if result["status"] != "ok":
+            return result
+        if best is None or result["seconds"] < best["seconds"]:
+            best = result
+        best["peak_rss_mb"] = max(best["peak_rss_mb"], result["peak_rss_mb"])
+    seconds = max(best["seconds"], 1e-9)
+    best["items_per_s"] = best["items"] / seconds
+    best["mb_per_s"] = best["bytes"] / 1024**2 / seconds
+    return best
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], cwd=SCRIPT_DIR, capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def cmd_run(args):
+    params = {
+        "videos": args.videos,
+        "video_size": args.video_size,
+        "captions": args.captions,
+        "download_size": args.download_size,
+        "stream_lines": args.stream_lines,
+        "cache_files": args.cache_files,
+    }
+    names = args.only or list(BENCHMARKS)
+    print(f"🏁 Executando {len(names)} benchmarks ({args.repeat}x cada)...")
+    results = {}
+    for name in names:
+        result = run_benchmark(name, params, args.repeat)
+        results[name] = result
+        if result["status"] == "ok":
+            print(f"   ✅ {name:<22} {result['seconds']:8.3f}s  {result['items_per_s']:10.1f} itens/s  {result['mb_per_s']:8.1f} MB/s  pico {result['peak_rss_mb']:.0f} MB")
+        else:
+            print(f"   ⚠️  {name:<22} {result['status']}: {result['reason']}")
+
+    report = {
+        "meta": {
+            "commit": git_commit(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "params": params,
+            "repeat": args.repeat,
+        },
+        "results": results,
+    }
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2)
+    print(f"\n📄 Resultados salvos em '{args.output}'")
+
+
+def compare_reports(base, new, threshold):
+    """
+    Compara dois relatórios e retorna as regressões encontradas:
+    vazão (itens/s) menor ou pico de memória maior que o limite relativo.
+    """
+    regressions = []
+    rows = []
+    for name, new_result in new["results"].items():
+        base_result = base["results"].get(name)
+        if not base_result or base_result.get("status") != "ok" or new_result.get("status") != "ok":
+            continue
+        speed = new_result["items_per_s"] / base_result["items_per_s"] - 1
+        memory = new_result["peak_rss_mb"] / base_result["peak_rss_mb"] - 1
+        rows.append((name, speed, memory))
+        if speed < -threshold:
+            regressions.append(f"{name}: vazão {speed:+.1%}")
+        if memory > threshold:
+            regressions.append(f"{name}: pico de memória {memory:+.1%}")
+    return rows, regressions
+
+
+def cmd_compare(args):
+    with open(args.base, 'r', encoding='utf-8') as f:
+        base = json.load(f)
+    with open(args.new, 'r', encoding='utf-8') as f:
+        new = json.load(f)
+
+    if base["meta"]["params"] != new["meta"]["params"]:
+        print("⚠️  Os dois relatórios usaram parâmetros diferentes; a comparação pode não ser justa.")
+
+    rows, regressions = compare_reports(base, new, args.threshold)
+    print(f"Base: {base['meta']['commit'] or '?'}  ->  Novo: {new['meta']['commit'] or '?'}\n")
+    print(f"{'Etapa':<24}{'Vazão':>10}{'Memória':>10}")
+    for name, speed, memory in rows:
+        print(f"{name:<24}{speed:>+10.1%}{memory:>+10.1%}")
+
+    if regressions:
+        print(f"\n❌ Regressões acima de {args.threshold:.0%}:")
+        for regression in regressions:
+            print(f"   - {regression}")
+        sys.exit(1)
+    print(f"\n✅ Nenhuma regressão acima de {args.threshold:.0%}.")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark das etapas do pipeline sobre dados sintéticos.", formatter_class=argparse.RawTextHelpFormatter)
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = subparsers.add_parser("run", help="Executa os benchmarks e salva o resultado em JSON.")
+    run_parser.add_argument("-o", "--output", type=str, default="bench_output.json", help="Arquivo JSON de saída (padrão: bench_output.json)")
+    run_parser.add_argument("--only", nargs="+", choices=list(BENCHMARKS), help="Executa apenas as etapas indicadas.")
+    run_parser.add_argument("--repeat", type=int, default=DEFAULT_REPEAT, help=f"Repetições por etapa; vale a mais rápida (padrão: {DEFAULT_REPEAT})")
+    run_parser.add_argument("--videos", type=int, default=DEFAULT_VIDEOS, help=f"Vídeos no .zip sintético (padrão: {DEFAULT_VIDEOS})")
+    run_parser.add_argument("--video_size", type=int, default=DEFAULT_VIDEO_SIZE, help=f"Tamanho de cada vídeo falso em bytes (padrão: {DEFAULT_VIDEO_SIZE})")
+    run_parser.add_argument("--captions", type=int, default=DEFAULT_CAPTIONS, help=f"Arquivos de legenda, ex: 10000 a 100000 (padrão: {DEFAULT_CAPTIONS})")
+    run_parser.add_argument("--download_size", type=int, default=DEFAULT_DOWNLOAD_SIZE, help=f"Tamanho do arquivo servido localmente em bytes (padrão: {DEFAULT_DOWNLOAD_SIZE})")
+    run_parser.add_argument("--stream_lines", type=int, default=DEFAULT_STREAM_LINES, help=f"Linhas emitidas pelo subprocesso (padrão: {DEFAULT_STREAM_LINES})")
+    run_parser.add_argument("--cache_files", type=int, default=DEFAULT_CACHE_FILES, help=f"Arquivos .safetensors sintéticos do cache (padrão: {DEFAULT_CACHE_FILES})")
+    run_parser.set_defaults(func=cmd_run)
+
+    compare_parser = subparsers.add_parser("compare", help="Compara dois resultados e aponta regressões.")
+    compare_parser.add_argument("base", type=str, help="JSON de referência (ex: commit anterior).")
+    compare_parser.add_argument("new", type=str, help="JSON a ser avaliado.")
+    compare_parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD, help=f"Piora relativa tolerada (padrão: {DEFAULT_THRESHOLD})")
+    compare_parser.set_defaults(func=cmd_compare)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,18 +1,69 @@
 #!/bin/bash
 # Script de instalação CORRIGIDO para o Musubi Tuner no ambiente Runpod
-# Versão 2: Corrige o conflito de dependência do torchaudio.
+# Versão 3: Pula toda a instalação quando o ambiente já está pronto (fingerprint)
+# e reinstala a partir de um cache local de wheels no volume persistente.
 set -e
 
+# --- CONFIGURAÇÕES ---
+# Pastas no volume persistente: sobrevivem à recriação do pod
+BOOTSTRAP_DIR="${BOOTSTRAP_DIR:-/workspace/.bootstrap}"
+WHEELHOUSE_DIR="${WHEELHOUSE_DIR:-/workspace/wheelhouse}"
+FINGERPRINT_FILE="$BOOTSTRAP_DIR/env.fingerprint"
+LOCK_FILE="$WHEELHOUSE_DIR/requirements.lock"
+DOWNLOAD_JOBS=8 # Downloads paralelos ao popular o cache de wheels
+
+TORCH_INDEX_URL="https://download.pytorch.org/whl/cu124"
+MUSUBI_DIR="$(pwd)/musubi-tuner-main"
+
 echo "-----------------------------------------------------"
-echo "Iniciando a instalação do Musubi Tuner (v2)..."
+echo "Iniciando a instalação do Musubi Tuner (v3)..."
 echo "-----------------------------------------------------"
 echo ""
 
-# --- PASSO 1: Atualizar pacotes do sistema e instalar ferramentas úteis ---
-echo "--> Atualizando lista de pacotes e instalando git e nano..."
-apt-get update
-apt-get install -y git nano
-echo "--> Ferramentas do sistema instaladas."
+# Calcula o fingerprint do ambiente: este script (versões fixadas), versão do Python,
+# commit do Musubi e versões de todos os pacotes instalados.
+SCRIPT_PATH="$(cd "$(dirname "${BASH_SOURCE[0]}")" && pwd)/$(basename "${BASH_SOURCE[0]}")"
+compute_fingerprint() {
+    {
+        cat "$SCRIPT_PATH"
+        python --version 2>&1
+        git -C "$MUSUBI_DIR" rev-parse HEAD 2>/dev/null || echo "sem-repositorio"
+        pip freeze --all 2>/dev/null | sort
+    } | sha256sum | cut -d' ' -f1
+}
+
+# 'uv' instala os pacotes em paralelo; se não existir, usa o pip
+if command -v uv > /dev/null; then
+    PIP_INSTALL=(uv pip install --system)
+else
+    PIP_INSTALL=(pip install)
+fi
+
+# --- PASSO 0: Verificar se o ambiente já está pronto ---
+mkdir -p "$BOOTSTRAP_DIR" "$WHEELHOUSE_DIR"
+if [ -d "$MUSUBI_DIR" ] && [ -f "$FINGERPRINT_FILE" ]; then
+    echo "--> Verificando o fingerprint do ambiente..."
+    if [ "$(compute_fingerprint)" == "$(cat "$FINGERPRINT_FILE")" ]; then
+        echo "--> Ambiente idêntico ao da última instalação. Nada a fazer."
+        echo ""
+        echo "-----------------------------------------------------"
+        echo "✅ Musubi Tuner já está instalado e pronto!"
+        echo "-----------------------------------------------------"
+        exit 0
+    fi
+    echo "--> O ambiente mudou desde a última instalação (pod novo ou pacotes alterados)."
+fi
+echo ""
+
+# --- PASSO 1: Instalar ferramentas do sistema (apenas se faltarem) ---
+if command -v git > /dev/null && command -v nano > /dev/null; then
+    echo "--> git e nano já estão instalados. Pulando o apt-get."
+else
+    echo "--> Atualizando lista de pacotes e instalando git e nano..."
+    apt-get update
+    apt-get install -y git nano
+    echo "--> Ferramentas do sistema instaladas."
+fi
 echo ""
 
 # --- PASSO 2: Clonar o repositório do Musubi Tuner ---
@@ -26,24 +77,43 @@ fi
 cd musubi-tuner-main
 echo ""
 
+# --- CAMINHO RÁPIDO: reinstalar o ambiente resolvido a partir do cache de wheels ---
+# O lock contém as versões exatas da última instalação bem-sucedida; com todas as
+# wheels no volume persistente, a instalação não precisa de internet nem de resolver nada.
+if [ -f "$LOCK_FILE" ]; then
+    echo "--> Cache de wheels encontrado. Instalando as versões travadas em '$LOCK_FILE'..."
+    if "${PIP_INSTALL[@]}" --no-index --find-links "$WHEELHOUSE_DIR" -r "$LOCK_FILE" \
+        && pip install --no-deps -e . \
+        && pip check; then
+        compute_fingerprint > "$FINGERPRINT_FILE"
+        echo "-----------------------------------------------------"
+        echo "✅ Ambiente restaurado a partir do cache de wheels!"
+        echo "-----------------------------------------------------"
+        echo "Você está no diretório: $(pwd)"
+        echo "O ambiente está pronto para o treinamento."
+        exit 0
+    fi
+    echo "--> Não foi possível usar o cache de wheels. Seguindo com a instalação completa."
+fi
+echo ""
+
 # --- PASSO 3: Atualizar PyTorch, torchvision e torchaudio (RECOMENDADO) ---
 echo "--> Verificando a versão do PyTorch..."
-CURRENT_PYTORCH_VERSION=$(python -c "import torch; print(torch.__version__)")
+CURRENT_PYTORCH_VERSION=$(python -c "import torch; print(torch.__version__)" 2>/dev/null || echo "não instalado")
 echo "    Versão atual do PyTorch: $CURRENT_PYTORCH_VERSION"
 echo "    Versão recomendada pelo Musubi Tuner: 2.5.1 ou superior"
 echo ""
 echo "--> ATUALIZANDO torch, torchvision e torchaudio juntos para manter a compatibilidade..."
-sleep 3
 
 # CORREÇÃO: Adicionado 'torchaudio' à linha de atualização
-pip install --upgrade torch torchvision torchaudio --index-url https://download.pytorch.org/whl/cu124
+pip install --upgrade torch torchvision torchaudio --index-url "$TORCH_INDEX_URL"
 echo "--> Ecossistema PyTorch atualizado com sucesso."
 echo ""
 
 
 # --- PASSO 4: Instalar as dependências Python do Musubi Tuner ---
 echo "--> Instalando as dependências Python a partir do pyproject.toml..."
-pip install \
+"${PIP_INSTALL[@]}" \
     "accelerate==1.6.0" \
     "av==14.0.1" \
     "bitsandbytes==0.45.4" \
@@ -64,7 +134,7 @@ echo ""
 
 # --- PASSO 5: Instalar dependências opcionais (para logging e visualização) ---
 echo "--> Instalando dependências opcionais (matplotlib, tensorboard)..."
-pip install matplotlib tensorboard prompt-toolkit
+"${PIP_INSTALL[@]}" matplotlib tensorboard prompt-toolkit
 echo "--> Dependências opcionais instaladas."
 echo ""
 
@@ -82,8 +152,27 @@ pip check
 echo "--> Verificação concluída. (Aviso sobre 'pycairo' pode ser ignorado com segurança)"
 echo ""
 
+
+# --- PASSO 8: Popular o cache de wheels e registrar o fingerprint ---
+echo "--> Salvando as wheels do ambiente resolvido em '$WHEELHOUSE_DIR' (downloads em paralelo)..."
+# Apenas pacotes vindos de um índice (ignora o próprio Musubi e instalações locais)
+pip freeze --exclude-editable | grep -v " @ " > "$LOCK_FILE.tmp" || true
+# Cada pacote é baixado com a versão exata e sem dependências, então os downloads
+# podem rodar em paralelo; arquivos já presentes no cache são pulados.
+if xargs -a "$LOCK_FILE.tmp" -P "$DOWNLOAD_JOBS" -n 8 \
+    pip download --quiet --no-deps --dest "$WHEELHOUSE_DIR" --extra-index-url "$TORCH_INDEX_URL"; then
+    mv "$LOCK_FILE.tmp" "$LOCK_FILE"
+    echo "--> Cache de wheels atualizado."
+else
+    rm -f "$LOCK_FILE.tmp"
+    echo "--> AVISO: Não foi possível baixar todas as wheels. O próximo pod fará a instalação completa."
+fi
+compute_fingerprint > "$FINGERPRINT_FILE"
+echo "--> Fingerprint do ambiente salvo em '$FINGERPRINT_FILE'."
+echo ""
+
 echo "-----------------------------------------------------"
 echo "✅ Instalação do Musubi Tuner concluída com sucesso!"
 echo "-----------------------------------------------------"
 echo "Você está no diretório: $(pwd)"
-echo "O ambiente está pronto para o treinamento."
\ No newline at end of file
+echo "O ambiente está pronto para o treinamento."
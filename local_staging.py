@@ -0,0 +1,247 @@
+# local_staging.py
+# Copia modelos, vídeos e caches do volume de rede (/workspace) para o disco local (NVMe)
+# antes do pré-cache/treinamento, e sincroniza as saídas de volta em segundo plano.
+import os
+import re
+import shutil
+import threading
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+
+# --- CONFIGURAÇÕES ---
+# O staging é ativado por '--stage_dir' ou por esta variável de ambiente
+STAGE_DIR_ENV = "WANTRAINITA_STAGE_DIR"
+COPY_CHUNK_SIZE = 16 * 1024 * 1024 # Leituras sequenciais grandes rendem mais em discos de rede
+COPY_WORKERS = 8
+SYNC_INTERVAL_SECONDS = 120
+
+
+def default_stage_dir():
+    """Retorna a pasta de staging definida no ambiente, ou None se o staging estiver desativado."""
+    value = os.environ.get(STAGE_DIR_ENV)
+    return Path(value) if value else None
+
+
+def local_path_for(src, stage_dir):
+    """Caminho local espelhado de 'src' dentro de stage_dir (ex: /workspace/models -> <stage_dir>/workspace/models)."""
+    src = Path(src).absolute()
+    return Path(stage_dir).absolute() / src.relative_to(src.anchor)
+
+
+def is_up_to_date(src, dst):
+    """Considera a cópia válida se tamanho e mtime forem idênticos aos da origem."""
+    try:
+        src_stat, dst_stat = os.stat(src), os.stat(dst)
+    except FileNotFoundError:
+        return False
+    return src_stat.st_size == dst_stat.st_size and src_stat.st_mtime_ns == dst_stat.st_mtime_ns
+
+
+def copy_file_fast(src, dst, cancel_event=None):
+    """
+    Copia um arquivo com leituras sequenciais grandes, avisando o kernel para
+    fazer readahead agressivo na origem. Grava em um arquivo temporário e renomeia
+    no final, preservando o mtime para que a verificação de reuso funcione.
+    """
+    dst = Path(dst)
+    dst.parent.mkdir(parents=True, exist_ok=True)
+    # Nome temporário único: vários jobs da fila podem fazer staging do mesmo dataset
+    tmp_dst = dst.with_name(f"{dst.name}.{os.getpid()}.{threading.get_ident()}.staging")
+    buffer = bytearray(COPY_CHUNK_SIZE)
+    view = memoryview(buffer)
+
+    try:
+        with open(src, 'rb', buffering=0) as fin, open(tmp_dst, 'wb', buffering=0) as fout:
+            fd = fin.fileno()
+            if hasattr(os, "posix_fadvise"):
+                os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_SEQUENTIAL)
+                os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_WILLNEED)
+            while True:
+                if cancel_event is not None and cancel_event.is_set():
+                    break
+                n = fin.readinto(buffer)
+                if not n:
+                    break
+                fout.write(view[:n])
+            if hasattr(os, "posix_fadvise"):
+                # A origem não será lida de novo: libera o page cache para a cópia local
+                os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+    except OSError:
+        # Ex: disco local cheio; não deixa uma cópia parcial ocupando espaço
+        tmp_dst.unlink(missing_ok=True)
+        raise
+
+    if cancel_event is not None and cancel_event.is_set():
+        tmp_dst.unlink(missing_ok=True)
+        return
+
+    shutil.copystat(src, tmp_dst)
+    os.replace(tmp_dst, dst)
+
+
+def _iter_files(src):
+    src = Path(src)
+    if src.is_file():
+        yield src
+        return
+    for root, _, files in os.walk(src):
+        for name in files:
+            yield Path(root) / name
+
+
+def mirror(src, dst, delete=False, workers=COPY_WORKERS, cancel_event=None):
+    """
+    Copia para 'dst' os arquivos de 'src' que faltam ou mudaram (arquivo ou pasta).
+
+    Args:
+        delete (bool): Remove de 'dst' os arquivos que não existem mais em 'src'.
+
+    Returns:
+        tuple: (arquivos copiados, bytes copiados)
+    """
+    src, dst = Path(src), Path(dst)
+    if src.is_dir():
+        # Recria também as pastas vazias (ex: um cache que ainda será gerado)
+        for root, _, _ in os.walk(src):
+            (dst / Path(root).relative_to(src)).mkdir(parents=True, exist_ok=True)
+    pending = []
+    for file_path in _iter_files(src):
+        if file_path.name.endswith(".staging"):
+            continue
+        target = dst / file_path.relative_to(src) if src.is_dir() else dst
+        if not is_up_to_date(file_path, target):
+            pending.append((file_path, target))
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        list(executor.map(lambda pair: copy_file_fast(*pair, cancel_event=cancel_event), pending))
+
+    if delete and src.is_dir() and dst.is_dir():
+        for file_path in list(_iter_files(dst)):
+            if not (src / file_path.relative_to(dst)).exists():
+                file_path.unlink(missing_ok=True)
+        # Remove as pastas que ficaram vazias (ex: estados antigos podados). O conteúdo é
+        # relido porque as subpastas acabaram de ser removidas nesta mesma passada.
+        for root, _, _ in os.walk(dst, topdown=False):
+            root = Path(root)
+            if root != dst and not os.listdir(root) and not (src / root.relative_to(dst)).exists():
+                root.rmdir()
+
+    return len(pending), sum(src_file.stat().st_size for src_file, _ in pending)
+
+
+def top_level_paths(paths):
+    """Remove da lista os caminhos que já estão contidos em outro (ex: cache dentro da pasta de vídeos)."""
+    paths = sorted({Path(p).absolute() for p in paths})
+    return [p for p in paths if not any(other != p and other in p.parents for other in paths)]
+
+
+def stage_paths(paths, stage_dir, workers=COPY_WORKERS, cancel_event=None):
+    """
+    Copia os arquivos/pastas para o disco local, pulando o que já está atualizado.
+    Caminhos que ainda não existem (ex: um cache a ser gerado) são apenas mapeados.
+
+    Returns:
+        dict: Mapeamento {caminho original: caminho local}.
+    """
+    mapping = {Path(src).absolute(): local_path_for(src, stage_dir) for src in paths}
+    copied_files = copied_bytes = 0
+    for src in top_level_paths(paths):
+        if not src.exists():
+            continue
+        local = mapping[src]
+        files, size = mirror(src, local, workers=workers, cancel_event=cancel_event)
+        copied_files += files
+        copied_bytes += size
+    print(f"   📦 Staging concluído: {copied_files} arquivos copiados ({copied_bytes / 1024**3:.2f} GB), o restante já estava atualizado.", flush=True)
+    return mapping
+
+
+class StagingTask:
+    """
+    Staging em segundo plano, para que as verificações do ambiente rodem em paralelo.
+    result() aguarda e retorna o mapeamento de stage_paths(); cancel() interrompe as cópias.
+    """
+
+    def __init__(self, paths, stage_dir, workers=COPY_WORKERS):
+        self._cancel_event = threading.Event()
+        self._executor = ThreadPoolExecutor(max_workers=1)
+        self._future = self._executor.submit(stage_paths, list(paths), stage_dir, workers, self._cancel_event)
+        self._executor.shutdown(wait=False)
+
+    def result(self):
+        return self._future.result()
+
+    def cancel(self):
+        self._cancel_event.set()
+
+
+def start_staging(paths, stage_dir, workers=COPY_WORKERS):
+    """Inicia o staging dos caminhos informados em segundo plano (ver StagingTask)."""
+    return StagingTask(paths, stage_dir, workers)
+
+
+def rewrite_dataset_toml(toml_path, stage_dir, output_path, keys=("video_directory", "cache_directory")):
+    """
+    Gera uma cópia do dataset.toml apontando as pastas em 'keys' para as cópias
+    locais; as demais continuam no /workspace. Caminhos relativos são resolvidos
+    a partir do diretório atual, assim como o musubi-tuner faz.
+
+    Returns:
+        list: Pastas originais referenciadas no TOML (para staging/sincronização).
+    """
+    referenced = []
+
+    def replace(match):
+        original = Path(match.group(2)).absolute()
+        referenced.append(original)
+        return f'{match.group(1)}"{local_path_for(original, stage_dir).as_posix()}"'
+
+    content = Path(toml_path).read_text(encoding='utf-8')
+    pattern = rf'^(\s*(?:{"|".join(map(re.escape, keys))})\s*=\s*)"([^"]*)"'
+    content = re.sub(pattern, replace, content, flags=re.MULTILINE)
+
+    output_path = Path(output_path)
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+    output_path.write_text(content, encoding='utf-8')
+    return referenced
+
+
+class BackgroundSync:
+    """
+    Sincroniza uma pasta local de volta para o volume persistente periodicamente,
+    em uma thread, sem bloquear o processo principal. stop() faz a sincronização final
+    e retorna False se ela falhar.
+    """
+
+    def __init__(self, local_dir, remote_dir, interval=SYNC_INTERVAL_SECONDS, delete=False):
+        self.local_dir = Path(local_dir)
+        self.remote_dir = Path(remote_dir)
+        self.interval = interval
+        self.delete = delete
+        self._stop_event = threading.Event()
+        self._thread = threading.Thread(target=self._loop, daemon=True)
+
+    def _sync(self):
+        if not self.local_dir.exists():
+            return True
+        try:
+            files, size = mirror(self.local_dir, self.remote_dir, delete=self.delete)
+            if files:
+                print(f"\n🔄 {files} arquivos ({size / 1024**2:.1f} MB) sincronizados para '{self.remote_dir}'", flush=True)
+            return True
+        except OSError as e:
+            print(f"\n⚠️  Falha ao sincronizar '{self.local_dir}' -> '{self.remote_dir}': {e}", flush=True)
+            return False
+
+    def _loop(self):
+        while not self._stop_event.wait(self.interval):
+            self._sync()
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop_event.set()
+        self._thread.join()
+        return self._sync()
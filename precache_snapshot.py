@@ -0,0 +1,284 @@
+# precache_snapshot.py
+# Salva e restaura o pré-cache (latents VAE + saídas do T5) em um arquivo compactado,
+# identificado por uma "impressão digital" do dataset, dos modelos e da configuração.
+# Se nada mudou, o 5_run_precaching.py restaura o snapshot em vez de recalcular tudo.
+import os
+import re
+import sys
+import json
+import struct
+import hashlib
+import argparse
+import subprocess
+from pathlib import Path
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+# --- CONFIGURAÇÕES ---
+WORKSPACE_DIR = Path("/workspace")
+DEFAULT_SNAPSHOT_DIR = WORKSPACE_DIR / "precache_snapshots"
+DEFAULT_DATASET_CONFIG = WORKSPACE_DIR / "dataset.toml"
+DEFAULT_MODEL_FILES = [
+    WORKSPACE_DIR / "models" / "Wan2.1_VAE.pth",
+    WORKSPACE_DIR / "models" / "models_clip_open-clip-xlm-roberta-large-vit-huge-14.pth",
+    WORKSPACE_DIR / "models" / "models_t5_umt5-xxl-enc-bf16.pth",
+]
+
+SNAPSHOT_EXTENSION = ".wcache"
+SNAPSHOT_VERSION = 1
+MAGIC = b"WCACHE1\n"
+FOOTER = struct.Struct("<Q8s") # posição do índice + MAGIC
+CHUNK_SIZE = 32 * 1024 * 1024 # Cada bloco vira um frame zstd independente (descompressão paralela)
+COMPRESSION_LEVEL = 3
+WORKERS = os.cpu_count() or 4
+# Arquivos pequenos entram inteiros no fingerprint; os grandes, por tamanho + início + fim
+FULL_HASH_LIMIT = 4 * 1024 * 1024
+PARTIAL_HASH_BYTES = 1024 * 1024
+# O musubi-tuner grava os latents e as saídas do T5 como .safetensors
+CACHE_FILE_SUFFIX = ".safetensors"
+
+
+def check_and_install_zstandard():
+    """Verifica se 'zstandard' está instalado e, se não estiver, instala usando o pip."""
+    try:
+        import zstandard
+    except ImportError:
+        print("A biblioteca 'zstandard' não foi encontrada. Instalando automaticamente...")
+        try:
+            subprocess.check_call([sys.executable, "-m", "pip", "install", "zstandard"])
+        except subprocess.CalledProcessError as e:
+            print("Erro ao instalar 'zstandard'. Por favor, instale manualmente usando 'pip install zstandard'.")
+            print(f"Erro do subprocesso: {e}")
+            sys.exit(1)
+        import zstandard
+    return zstandard
+
+
+def read_dataset_dirs(dataset_config):
+    """
+    Lê os pares (video_directory, cache_directory) de cada [[datasets]] do TOML.
+    Caminhos relativos são resolvidos a partir do diretório atual, como no musubi-tuner.
+    """
+    content = Path(dataset_config).read_text(encoding='utf-8')
+    pairs = []
+    for section in re.split(r'^\s*\[\[datasets\]\]\s*$', content, flags=re.MULTILINE)[1:]:
+        video = re.search(r'^\s*video_directory\s*=\s*"([^"]*)"', section, flags=re.MULTILINE)
+        cache = re.search(r'^\s*cache_directory\s*=\s*"([^"]*)"', section, flags=re.MULTILINE)
+        if not video:
+            continue
+        video_dir = Path(video.group(1)).absolute()
+        cache_dir = Path(cache.group(1)).absolute() if cache else video_dir
+        pairs.append((video_dir, cache_dir))
+    return pairs
+
+
+def _hash_file(path, digest):
+    size = path.stat().st_size
+    digest.update(f"{size}\n".encode())
+    with open(path, 'rb') as f:
+        if size <= FULL_HASH_LIMIT:
+            digest.update(f.read())
+        else:
+            digest.update(f.read(PARTIAL_HASH_BYTES))
+            f.seek(-PARTIAL_HASH_BYTES, os.SEEK_END)
+            digest.update(f.read(PARTIAL_HASH_BYTES))
+
+
+def compute_fingerprint(dataset_config, model_files):
+    """
+    Calcula o fingerprint do pré-cache a partir de:
+      - manifesto do dataset (nome, tamanho e conteúdo dos vídeos e legendas);
+      - modelos usados no cache (nome e tamanho);
+      - configuração do dataset.toml relevante para o cache (sem os caminhos).
+
+    Returns:
+        str: Fingerprint hexadecimal (16 caracteres).
+    """
+    digest = hashlib.sha256(f"wantrainita-precache-v{SNAPSHOT_VERSION}\n".encode())
+
+    config = Path(dataset_config).read_text(encoding='utf-8')
+    config = re.sub(r'^\s*(video_directory|cache_directory)\s*=.*$', '', config, flags=re.MULTILINE)
+    digest.update(config.encode())
+
+    for model_file in model_files:
+        model_file = Path(model_file)
+        size = model_file.stat().st_size if model_file.exists() else -1
+        digest.update(f"model:{model_file.name}:{size}\n".encode())
+
+    for video_dir, cache_dir in read_dataset_dirs(dataset_config):
+        for root, dirs, files in os.walk(video_dir):
+            dirs.sort()
+            # O próprio cache não faz parte do manifesto
+            dirs[:] = [d for d in dirs if (Path(root) / d).absolute() != cache_dir]
+            for name in sorted(files):
+                path = Path(root) / name
+                if cache_dir in path.absolute().parents or name.endswith(CACHE_FILE_SUFFIX):
+                    continue
+                digest.update(f"file:{path.relative_to(video_dir).as_posix()}\n".encode())
+                _hash_file(path, digest)
+
+    return digest.hexdigest()[:16]
+
+
+def snapshot_path(snapshot_dir, fingerprint):
+    return Path(snapshot_dir) / f"precache-{fingerprint}{SNAPSHOT_EXTENSION}"
+
+
+def _iter_chunks(cache_dirs):
+    """Gera (índice do dataset, caminho relativo, arquivo, offset, tamanho) para cada bloco do cache."""
+    for index, cache_dir in enumerate(cache_dirs):
+        for root, dirs, files in os.walk(cache_dir):
+            dirs.sort()
+            for name in sorted(files):
+                if not name.endswith(CACHE_FILE_SUFFIX):
+                    continue
+                path = Path(root) / name
+                size = path.stat().st_size
+                rel_path = path.relative_to(cache_dir).as_posix()
+                offsets = range(0, size, CHUNK_SIZE) if size else [0]
+                for offset in offsets:
+                    yield index, rel_path, path, offset, min(CHUNK_SIZE, size - offset)
+
+
+def create_snapshot(cache_dirs, output_path, workers=WORKERS):
+    """
+    Compacta as pastas de cache em um arquivo único e pesquisável (seekable).
+
+    Formato: MAGIC, frames zstd independentes (um por bloco de até CHUNK_SIZE),
+    índice JSON compactado e rodapé com a posição do índice. O índice permite
+    descompactar qualquer arquivo diretamente e em paralelo.
+    """
+    zstandard = check_and_install_zstandard()
+    output_path = Path(output_path)
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = output_path.with_name(output_path.name + ".tmp")
+
+    def compress(chunk):
+        index, rel_path, path, offset, length = chunk
+        with open(path, 'rb') as f:
+            f.seek(offset)
+            data = f.read(length)
+        # O checksum de cada frame detecta blocos corrompidos na restauração
+        return chunk, zstandard.ZstdCompressor(level=COMPRESSION_LEVEL, write_checksum=True).compress(data)
+
+    entries = {}
+    raw_total = 0
+    with open(tmp_path, 'wb') as out, ThreadPoolExecutor(max_workers=workers) as executor:
+        out.write(MAGIC)
+        window = deque()
+
+        def write_next():
+            (index, rel_path, _, offset, length), compressed = window.popleft().result()
+            entry = entries.setdefault((index, rel_path), {"dataset": index, "path": rel_path, "size": 0, "chunks": []})
+            entry["chunks"].append([out.tell(), len(compressed), length])
+            entry["size"] += length
+            out.write(compressed)
+            return length
+
+        # Janela limitada de blocos em processamento para não estourar a memória
+        for chunk in _iter_chunks(cache_dirs):
+            window.append(executor.submit(compress, chunk))
+            if len(window) >= workers * 2:
+                raw_total += write_next()
+        while window:
+            raw_total += write_next()
+
+        index_offset = out.tell()
+        index_data = json.dumps({"version": SNAPSHOT_VERSION, "files": list(entries.values())}).encode()
+        out.write(zstandard.ZstdCompressor(level=COMPRESSION_LEVEL).compress(index_data))
+        out.write(FOOTER.pack(index_offset, MAGIC))
+
+    os.replace(tmp_path, output_path)
+    return len(entries), raw_total, output_path.stat().st_size
+
+
+def read_snapshot_index(snapshot_file):
+    """Lê o índice do snapshot a partir do rodapé."""
+    zstandard = check_and_install_zstandard()
+    with open(snapshot_file, 'rb') as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"'{snapshot_file}' não é um snapshot de pré-cache válido.")
+        f.seek(-FOOTER.size, os.SEEK_END)
+        footer_pos = f.tell()
+        index_offset, magic = FOOTER.unpack(f.read(FOOTER.size))
+        if magic != MAGIC:
+            raise ValueError(f"Snapshot '{snapshot_file}' está incompleto ou corrompido.")
+        f.seek(index_offset)
+        index_data = f.read(footer_pos - index_offset)
+    return json.loads(zstandard.ZstdDecompressor().decompress(index_data))
+
+
+def restore_snapshot(snapshot_file, cache_dirs, workers=WORKERS):
+    """
+    Restaura o snapshot nas pastas de cache, descompactando os arquivos em paralelo.
+    Um snapshot corrompido (frame zstd ou índice inválido) gera ValueError.
+
+    Returns:
+        tuple: (arquivos restaurados, bytes restaurados)
+    """
+    zstandard = check_and_install_zstandard()
+
+    def restore(entry):
+        target = Path(cache_dirs[entry["dataset"]]) / entry["path"]
+        target.parent.mkdir(parents=True, exist_ok=True)
+        tmp_target = target.with_name(target.name + ".restoring")
+        decompressor = zstandard.ZstdDecompressor()
+        try:
+            with open(snapshot_file, 'rb') as src, open(tmp_target, 'wb') as out:
+                for offset, compressed_len, raw_len in entry["chunks"]:
+                    data = decompressor.decompress(os.pread(src.fileno(), compressed_len, offset), max_output_size=raw_len)
+                    if len(data) != raw_len:
+                        raise ValueError(f"Bloco de '{entry['path']}' com tamanho inesperado.")
+                    out.write(data)
+        except BaseException:
+            # Não deixa arquivos parcialmente restaurados na pasta de cache
+            tmp_target.unlink(missing_ok=True)
+            raise
+        os.replace(tmp_target, target)
+        return entry["size"]
+
+    try:
+        index = read_snapshot_index(snapshot_file)
+        files = index["files"]
+        if any(entry["dataset"] >= len(cache_dirs) for entry in files):
+            raise ValueError("O snapshot não corresponde aos datasets do dataset.toml.")
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            restored_bytes = sum(executor.map(restore, files))
+    except (zstandard.ZstdError, KeyError, TypeError) as e:
+        raise ValueError(f"Snapshot '{snapshot_file}' está corrompido: {e!r}") from e
+    return len(files), restored_bytes
+
+
+def main():
+    """Função principal para criar ou restaurar snapshots manualmente."""
+    parser = argparse.ArgumentParser(
+        description="Cria ou restaura snapshots do pré-cache identificados pelo fingerprint do dataset.",
+        formatter_class=argparse.RawTextHelpFormatter
+    )
+    parser.add_argument("action", choices=["snapshot", "restore", "fingerprint"], help="snapshot: compacta o cache atual\nrestore: restaura o snapshot correspondente\nfingerprint: apenas exibe o fingerprint")
+    parser.add_argument("--dataset_config", type=Path, default=DEFAULT_DATASET_CONFIG, help=f"Arquivo dataset.toml (padrão: {DEFAULT_DATASET_CONFIG})")
+    parser.add_argument("--snapshot_dir", type=Path, default=DEFAULT_SNAPSHOT_DIR, help=f"Pasta dos snapshots (padrão: {DEFAULT_SNAPSHOT_DIR})")
+    args = parser.parse_args()
+
+    if not args.dataset_config.exists():
+        print(f"❌ ERRO: '{args.dataset_config}' não encontrado.")
+        sys.exit(1)
+
+    fingerprint = compute_fingerprint(args.dataset_config, DEFAULT_MODEL_FILES)
+    target = snapshot_path(args.snapshot_dir, fingerprint)
+    cache_dirs = [cache_dir for _, cache_dir in read_dataset_dirs(args.dataset_config)]
+    print(f"🔑 Fingerprint do pré-cache: {fingerprint}")
+
+    if args.action == "snapshot":
+        files, raw_size, archive_size = create_snapshot(cache_dirs, target)
+        print(f"✅ Snapshot criado: '{target}' ({files} arquivos, {raw_size / 1024**2:.1f} MB -> {archive_size / 1024**2:.1f} MB)")
+    elif args.action == "restore":
+        if not target.exists():
+            print(f"❌ Nenhum snapshot encontrado para este fingerprint em '{args.snapshot_dir}'.")
+            sys.exit(1)
+        files, size = restore_snapshot(target, cache_dirs)
+        print(f"✅ {files} arquivos ({size / 1024**2:.1f} MB) restaurados de '{target}'")
+
+
+if __name__ == "__main__":
+    main()